@@ -0,0 +1,89 @@
+"""Run many independent games in lockstep, without a server."""
+import logging
+import random
+
+from consts import LIVES, TIMEOUT
+from game import Game
+
+logger = logging.getLogger("Batch")
+logger.setLevel(logging.INFO)
+
+
+class BatchGame:
+    """N independent headless games stepped together.
+
+    Every game keeps its own copy of the `random` module state, so game i
+    always plays the same as a server started with the same seed. Games that
+    finish are restarted on the next seed of their lane, seed + i + k * n
+    for the k-th game played in lane i.
+    """
+
+    def __init__(self, n, seed=1, level=1, lives=LIVES, timeout=TIMEOUT, name="batch"):
+        self.n = n
+        self.seed = seed
+        self._level = level
+        self._lives = lives
+        self._timeout = timeout
+        self._name = name
+        self.games = [None] * n
+        self.seeds = [None] * n
+        self._rng = [None] * n
+        self._scores = [0] * n
+        self.episodes = [0] * n  # games finished per lane
+
+    def _run(self, i, fn, *args):
+        """Call fn with game i's random state swapped in."""
+        outer = random.getstate()
+        random.setstate(self._rng[i])
+        try:
+            return fn(*args)
+        finally:
+            self._rng[i] = random.getstate()
+            random.setstate(outer)
+
+    def _reset(self, i):
+        seed = self.seed + i + self.episodes[i] * self.n
+        outer = random.getstate()
+        random.seed(seed)
+        try:
+            game = Game(self._level, self._lives, self._timeout)
+            game.start(self._name)
+            self._rng[i] = random.getstate()
+        finally:
+            random.setstate(outer)
+
+        self.games[i] = game
+        self.seeds[i] = seed
+        self._scores[i] = game._score
+        return game.info()
+
+    def reset(self):
+        """Start all games and return their level info."""
+        self.episodes = [0] * self.n
+        return [self._reset(i) for i in range(self.n)]
+
+    def step(self, keys):
+        """Advance every game one frame with its key.
+
+        Returns the states, the score gained this frame and whether the game
+        ended. Finished games are restarted, so their next state is frame 1
+        of a new game. Like Game.step(), the state dicts are reused by the
+        next call.
+        """
+        assert len(keys) == self.n, f"Expected {self.n} keys, got {len(keys)}"
+
+        states, rewards, dones = [], [], []
+        for i, (game, key) in enumerate(zip(self.games, keys)):
+            state = self._run(i, game.step, key)
+            states.append(state)
+            rewards.append(game._score - self._scores[i])
+            self._scores[i] = game._score
+            dones.append(not game.running)
+
+        for i, done in enumerate(dones):
+            if done:
+                logger.debug("Game %s (seed %s) finished", i, self.seeds[i])
+                self.episodes[i] += 1
+                self._reset(i)
+
+        return states, rewards, dones
@@ -8,6 +8,7 @@ from consts import (
     BED_POINTS,
     BOTTOM_POINTS,
     ENEMY_HEAL_ODD,
+    FIRE_LEN,
     GROUND_POINTS,
     MIDDLE_POINTS,
     ROCK_KILL_POINTS,
@@ -27,6 +28,8 @@ logger.setLevel(logging.INFO)
 
 
 class Character:
+    _mutable = ("_history",)  # attributes changed in place, copied by snapshot()
+
     def __init__(self, x=1, y=1):
         self._pos = x, y
         self._spawn_pos = self._pos
@@ -69,6 +72,18 @@ class Character:
     def __str__(self) -> str:
         return f"{self.__class__.__name__}({self._pos})"
 
+    def snapshot(self):
+        """Copy of the character's mutable state, see restore()."""
+        state = self.__dict__.copy()
+        for attr in self._mutable:
+            state[attr] = state[attr].copy()
+        return state
+
+    def restore(self, state):
+        self.__dict__ = state.copy()
+        for attr in self._mutable:
+            self.__dict__[attr] = state[attr].copy()
+
     def respawn(self):
         logger.debug("RESPAWN %s @ %s", self, self._spawn_pos)
         self.pos = self._spawn_pos
@@ -224,9 +239,9 @@ class Enemy(Character):
     def alive(self):
         return self._alive > 0
 
-    def move(self, mapa, digdug, enemies, rocks):
+    def move(self, mapa, digdug, enemies, rocks, frames=1):
         self._history.append(self.pos)
-        if not self.ready():
+        if not self.ready(frames):
             return
 
         if self._alive < MIN_ENEMY_LIFE:
@@ -289,20 +304,33 @@ class Enemy(Character):
             self.exit = True
             logger.debug("%s has EXITED through %s", self.id, self.pos[1])
 
-    def ready(self):
-        self.step += int(self._speed)
+    def ready(self, frames=1):
+        self.step += int(self._speed) * frames
         if self.step >= int(Speed.FAST):
             self.step = 0
             return True
         return False
 
+    def frames_to_ready(self):
+        """Number of frames until ready() next returns True."""
+        return -(-(int(Speed.FAST) - self.step) // int(self._speed))
+
+    @property
+    def idle(self):
+        """Whether move() has nothing to do before the next ready frame."""
+        return True
+
 
 class Pooka(Enemy):
     def __init__(self, pos, smart=Smart.NORMAL):
         super().__init__(pos, self.__class__.__name__, Speed.FAST, smart, False)
         self.go_to_corridor = pos
 
-    def move(self, mapa, digdug, enemies, rocks):
+    @property
+    def idle(self):
+        return False  # rolls for wallpass on every frame
+
+    def move(self, mapa, digdug, enemies, rocks, frames=1):
         if self._wallpass:
             self._history.append(self.pos)
             open_pos = [
@@ -325,7 +353,7 @@ class Pooka(Enemy):
             if self.lastpos != self.pos:
                 self.lastdir = self._calc_dir(self.lastpos, self.pos)
         else:
-            super().move(mapa, digdug, enemies, rocks)
+            super().move(mapa, digdug, enemies, rocks, frames)
         if self._wallpass and not mapa.is_blocked(self.pos, False):
             self._wallpass = False
             self.go_to_corridor = random.choice(mapa.enemies_spawn)
@@ -335,6 +363,8 @@ class Pooka(Enemy):
 
 
 class Fygar(Enemy):
+    _mutable = ("_history", "fire")
+
     def __init__(self, pos, smart=Smart.NORMAL):
         self.fire = []
         super().__init__(pos, self.__class__.__name__, Speed.SLOW, smart, False)
@@ -345,8 +375,13 @@ class Fygar(Enemy):
 
         return super().points(map_height)
 
-    def move(self, mapa, digdug, enemies, rocks):
-        super().move(mapa, digdug, enemies, rocks)
+    @property
+    def idle(self):
+        # an unfrozen Fygar facing east/west may breathe fire on any frame
+        return self.freeze or self.lastdir not in [Direction.EAST, Direction.WEST]
+
+    def move(self, mapa, digdug, enemies, rocks, frames=1):
+        super().move(mapa, digdug, enemies, rocks, frames)
 
         fire_odd = 0.5 if digdug.pos[1] == self.pos[1] else 0.1
         if (
@@ -354,15 +389,9 @@ class Fygar(Enemy):
             and self.lastdir in [Direction.EAST, Direction.WEST]
             and random.random() < fire_odd
         ):
-            pos = self.pos
-            for _ in range(3):
-                pos = mapa.calc_pos(pos, self.dir[self.lastdir], traverse=False)
-                if (
-                    pos not in self.fire and
-                    pos != self.pos and
-                    pos not in [r.pos for r in rocks]
-                ):  # Make sure we don't fire on ourselves and prevent fire through rocks
-                    self.fire.append(pos)
-                else:
-                    break
+            rocks_pos = {r.pos for r in rocks}
+            for pos in mapa.reach(self.pos, self.dir[self.lastdir], FIRE_LEN):
+                if pos in self.fire or pos in rocks_pos:
+                    break  # prevent fire through rocks
+                self.fire.append(pos)
             self.freeze = True
@@ -58,7 +58,7 @@ async def agent_loop(server_address="localhost:8000", agent_name="student"):
                             pprint.pprint(state)
 
                         await websocket.send(
-                            json.dumps({"cmd": "key", "key": key})
+                            json.dumps({"cmd": "key", "key": key, "frame": state.get("frame")})
                         )  # send key command to server - you must implement this send in the AI agent
                         break
             except websockets.exceptions.ConnectionClosedOK:
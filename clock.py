@@ -0,0 +1,66 @@
+"""Fixed-timestep pacing for the game loop."""
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger("Clock")
+logger.setLevel(logging.INFO)
+
+CATCHUP, SKIP = "catchup", "skip"
+MAX_CATCHUP = 10  # frames we are willing to run back to back
+
+
+class FrameClock:
+    """Wakes up on a grid of monotonic deadlines, one every 1 / fps seconds.
+
+    Time spent simulating and sending between two ticks is absorbed, so the
+    tick rate does not drift. When a tick comes late the clock either
+    catches up (CATCHUP: run the missed frames back to back, up to
+    MAX_CATCHUP, then resync) or drops the missed ticks (SKIP: run now and
+    stay on the original grid).
+    """
+
+    def __init__(self, fps, policy=SKIP, max_catchup=MAX_CATCHUP, now=time.monotonic):
+        assert policy in (CATCHUP, SKIP), f"Unknown policy {policy}"
+        self.period = 1.0 / fps
+        self._now = now  # seconds, monotonic
+        self.policy = policy
+        self.max_catchup = max_catchup
+        self._deadline = None
+        self.lag = 0.0  # seconds the last tick was late
+        self.max_lag = 0.0
+        self.late = 0  # ticks that could not sleep
+        self.skipped = 0  # ticks dropped by the SKIP policy
+
+    def reset(self):
+        self._deadline = None
+
+    def wait(self):
+        """Advance to the next deadline; return how long to sleep for it."""
+        now = self._now()
+        if self._deadline is None:
+            self._deadline = now
+        self._deadline += self.period
+
+        self.lag = max(0.0, now - self._deadline)
+        self.max_lag = max(self.max_lag, self.lag)
+        if self.lag == 0.0:
+            return self._deadline - now
+
+        self.late += 1
+        missed = int(self.lag // self.period)
+        if self.policy == SKIP and missed:
+            self.skipped += missed
+            self._deadline += missed * self.period
+            logger.debug("Skipped %s ticks, %.1f ms behind", missed, self.lag * 1000)
+        elif self.policy == CATCHUP and missed > self.max_catchup:
+            logger.warning(
+                "%.1f ms behind, giving up on %s ticks", self.lag * 1000, missed
+            )
+            self.skipped += missed
+            self._deadline = now
+        return 0.0
+
+    async def tick(self):
+        """Sleep until the next frame is due."""
+        await asyncio.sleep(self.wait())
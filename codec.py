@@ -0,0 +1,181 @@
+"""Wire formats for server messages.
+
+JSON, sent as text frames, stays the default. Clients may ask for another
+codec in their join message ({"cmd": "join", "codec": "msgpack"}); binary
+codecs are sent as binary frames, so decode() can tell them apart. orjson
+and msgpack are optional, when missing the server falls back to JSON.
+
+Clients may also ask for the level map packed ({"map": "packed"}, see
+PackedMap). Bytes, like that packed map, are base64 strings in JSON and
+raw in binary codecs. The stdlib JSON codec encodes Static lists (the rocks
+of a level) once and splices them into every message that carries them.
+"""
+import base64
+import json
+import logging
+
+from mapa import pack_tiles
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger("Codec")
+logger.setLevel(logging.INFO)
+
+
+def _to_json(value):
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii")
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class Static(list):
+    """A list that stays the same for many frames, like the rocks of a level.
+
+    JsonCodec encodes it once and reuses the result when it is a top-level
+    value of a message. Do not change it in place: build a new one instead.
+    """
+
+    __slots__ = ("_encoded",)
+
+    def __init__(self, items=()):
+        super().__init__(items)
+        self._encoded = {}  # codec name -> encoded list
+
+    def encode(self, codec):
+        encoded = self._encoded.get(codec.name)
+        if encoded is None:
+            encoded = self._encoded[codec.name] = codec._dumps(self)
+        return encoded
+
+
+def _static(data):
+    """Keys of data holding a Static list."""
+    if not isinstance(data, dict):
+        return ()
+    return [k for k, v in data.items() if type(v) is Static]
+
+
+class JsonCodec:
+    name = "json"
+    binary = False
+
+    def _dumps(self, data):
+        return json.dumps(data, default=_to_json)
+
+    def dumps(self, data):
+        static = _static(data)
+        if not static:
+            return self._dumps(data)
+        body = self._dumps({k: v for k, v in data.items() if k not in static})
+        parts = [body[1:-1]] if len(body) > 2 else []
+        parts.extend(f"{self._dumps(k)}: {data[k].encode(self)}" for k in static)
+        return "{" + ", ".join(parts) + "}"
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+    """Same JSON text, encoded by orjson (several times faster for states).
+
+    Its own name, so cached encodings never mix with stdlib JSON output.
+    """
+
+    name = "orjson"
+
+    def dumps(self, data):
+        # one orjson call beats splicing in the cached Static lists
+        return orjson.dumps(data, default=_to_json).decode()
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+class MsgpackCodec:
+    name = "msgpack"
+    binary = True
+
+    def dumps(self, data):
+        return msgpack.packb(data)  # like orjson, faster than splicing
+
+    def loads(self, data):
+        return msgpack.unpackb(data)
+
+
+class PackedMap:
+    """codec, but with the "map" of level info as a mapa.pack_tiles() bitmask.
+
+    A 48x24 map packs into 144 bytes instead of ~3.5 KB of nested lists.
+    Clients read it back with mapa.unpack_tiles().
+    """
+
+    def __init__(self, codec):
+        self.codec = codec
+        self.name = f"{codec.name}+packed"
+        self.binary = codec.binary
+
+    def dumps(self, data):
+        if isinstance(data, dict) and isinstance(data.get("map"), list):
+            data = dict(data, map=pack_tiles(data["map"]))
+        return self.codec.dumps(data)
+
+    def loads(self, data):
+        return self.codec.loads(data)
+
+
+JSON = JsonCodec()
+FAST_JSON = OrjsonCodec() if orjson else JSON
+MSGPACK = MsgpackCodec() if msgpack else None
+
+
+def get_codec(name, fast_json=False, packed_map=False):
+    """Codec a client asked for; JSON if unknown or not installed here."""
+    codec = FAST_JSON if fast_json else JSON
+    if name == "msgpack" and MSGPACK:
+        codec = MSGPACK
+    elif name not in (None, "json"):
+        logger.warning("Codec %s not available, using JSON", name)
+    return PackedMap(codec) if packed_map else codec
+
+
+def wire_size(data):
+    """Bytes an encoded message takes on the wire (text frames are UTF-8)."""
+    if isinstance(data, str) and not data.isascii():
+        return len(data.encode())
+    return len(data)
+
+
+def decode(data):
+    """Message from a text (JSON) or binary (msgpack) frame."""
+    if isinstance(data, str):
+        return json.loads(data)
+    if MSGPACK is None:
+        raise ValueError("Binary message but msgpack is not installed")
+    return MSGPACK.loads(data)
+
+
+class Message:
+    """A message for many recipients, encoded at most once per codec.
+
+    Encode before the game steps again: states are reused between frames.
+    """
+
+    __slots__ = ("data", "_encoded")
+
+    def __init__(self, data):
+        self.data = data
+        self._encoded = {}
+
+    def encode(self, codec):
+        encoded = self._encoded.get(codec.name)
+        if encoded is None:
+            encoded = self._encoded[codec.name] = codec.dumps(self.data)
+        return encoded
@@ -4,6 +4,7 @@ GROUND_POINTS, MIDDLE_POINTS, BOTTOM_POINTS, BED_POINTS = 200, 300, 400, 500
 ROCK_KILL_POINTS = 1000
 
 MAX_LEN_ROPE = 3
+FIRE_LEN = 3
 MIN_ENEMIES = 3
 
 VITAL_SPACE = 3
@@ -0,0 +1,143 @@
+"""Delta encoding of game states.
+
+A keyframe is a full state plus ``"seq"`` and ``"keyframe": True``. Any other
+message carries only what changed since the previous frame:
+
+- top-level fields with their new value (``None`` means the field is gone,
+  e.g. ``"rope"`` after it is released);
+- ``"enemies"`` and ``"rocks"`` as ``{id: {field: new value}}``, with ``None``
+  for an entity (or entity field) that was removed.
+
+Clients feed every message to a DeltaDecoder, which passes other messages
+through and rebuilds the usual state dict.
+"""
+import logging
+
+logger = logging.getLogger("Delta")
+logger.setLevel(logging.INFO)
+
+KEYFRAME_INTERVAL = 40  # frames, one second at GAME_SPEED
+ENTITIES = ("enemies", "rocks")
+_MISSING = object()
+
+
+def _freeze(value):
+    """Immutable copy, so later in-place changes to the state are noticed."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple((k, _freeze(v)) for k, v in value.items())
+    return value
+
+
+def _diff(old, new):
+    """Fields of new that differ from the frozen old, None for removed ones."""
+    changes = {k: v for k, v in new.items() if old.get(k, _MISSING) != _freeze(v)}
+    changes.update((k, None) for k in old if k not in new)
+    return changes
+
+
+class DeltaEncoder:
+    """Turns the full state of consecutive frames into deltas."""
+
+    def __init__(self, keyframe=KEYFRAME_INTERVAL):
+        self.keyframe = keyframe
+        self.seq = 0
+        self.reset()
+
+    def reset(self):
+        """Make the next message a keyframe."""
+        self._fields = None
+        self._entities = {}
+
+    def _remember(self, state):
+        self._fields = {
+            k: _freeze(v) for k, v in state.items() if k not in ENTITIES
+        }
+        self._entities = {
+            kind: {
+                e["id"]: {k: _freeze(v) for k, v in e.items()}
+                for e in state.get(kind, [])
+            }
+            for kind in ENTITIES
+        }
+
+    def encode(self, state):
+        self.seq += 1
+        if self._fields is None or self.seq % self.keyframe == 0:
+            self._remember(state)
+            return {"seq": self.seq, "keyframe": True, **state}
+
+        message = {"seq": self.seq}
+        message.update(
+            _diff(self._fields, {k: v for k, v in state.items() if k not in ENTITIES})
+        )
+        for kind in ENTITIES:
+            old = self._entities[kind]
+            changes = {}
+            seen = set()
+            for e in state.get(kind, []):
+                seen.add(e["id"])
+                if e["id"] not in old:
+                    changes[e["id"]] = e
+                elif diff := _diff(old[e["id"]], e):
+                    changes[e["id"]] = diff
+            changes.update((id_, None) for id_ in old if id_ not in seen)
+            if changes:
+                message[kind] = changes
+
+        self._remember(state)
+        return message
+
+
+class DeltaDecoder:
+    """Client side: rebuilds full states from keyframes and deltas."""
+
+    def __init__(self):
+        self.seq = None
+        self._fields = {}
+        self._entities = {}
+
+    def apply(self, message):
+        """Full state for message, or None while waiting for a keyframe."""
+        if "seq" not in message:
+            return message  # not a frame (game info, highscores, ...)
+
+        seq = message.pop("seq")
+        if message.pop("keyframe", False):
+            self._fields = {k: v for k, v in message.items() if k not in ENTITIES}
+            self._entities = {
+                kind: {e["id"]: dict(e) for e in message.get(kind, [])} for kind in ENTITIES
+            }
+        elif self.seq is None or seq != self.seq + 1:
+            logger.debug("Missed frame %s, waiting for a keyframe", seq)
+            self.seq = None
+            return None
+        else:
+            for k, v in message.items():
+                if k in ENTITIES:
+                    self._apply_entities(self._entities[k], v)
+                elif v is None:
+                    self._fields.pop(k, None)
+                else:
+                    self._fields[k] = v
+        self.seq = seq
+
+        state = dict(self._fields)
+        for kind in ENTITIES:
+            state[kind] = [dict(e) for e in self._entities[kind].values()]
+        return state
+
+    @staticmethod
+    def _apply_entities(entities, changes):
+        for id_, fields in changes.items():
+            if fields is None:
+                entities.pop(id_, None)
+            elif id_ not in entities:
+                entities[id_] = dict(fields)
+            else:
+                for k, v in fields.items():
+                    if v is None:
+                        entities[id_].pop(k, None)
+                    else:
+                        entities[id_][k] = v
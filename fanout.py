@@ -0,0 +1,75 @@
+"""Per-viewer send queues, so a slow viewer never holds up a game."""
+import asyncio
+import logging
+from collections import deque
+
+from codec import JSON, wire_size
+
+logger = logging.getLogger("Fanout")
+logger.setLevel(logging.INFO)
+
+QUEUE_FRAMES = 4  # frames a viewer may fall behind before we drop
+
+
+class ViewerFeed:
+    """Outbox of one viewer, drained by its own task.
+
+    put() never blocks. When the viewer already has `maxsize` frames
+    waiting, the oldest waiting frame is dropped (the latest frame wins).
+    Messages put with droppable=False, like the level map, are always
+    delivered, and droppable ones must be full states, not deltas.
+    on_close(feed) is called once the viewer stops accepting messages.
+    codec is the wire format the viewer asked for.
+    """
+
+    def __init__(self, ws, on_close=None, maxsize=QUEUE_FRAMES, codec=JSON):
+        self.ws = ws
+        self.codec = codec
+        self.maxsize = maxsize
+        self.sent = 0
+        self.bytes = 0
+        self.dropped = 0
+        self._on_close = on_close
+        self._queue = deque()  # (message, droppable)
+        self._frames = 0  # droppable messages in the queue
+        self._ready = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, message, droppable=True):
+        if droppable:
+            if self._frames >= self.maxsize:
+                for i, (_, old) in enumerate(self._queue):
+                    if old:
+                        del self._queue[i]
+                        break
+                self._frames -= 1
+                self.dropped += 1
+            self._frames += 1
+        self._queue.append((message, droppable))
+        self._ready.set()
+
+    async def _run(self):
+        try:
+            while True:
+                await self._ready.wait()
+                while self._queue:
+                    message, droppable = self._queue.popleft()
+                    self._frames -= droppable
+                    await self.ws.send(message)
+                    self.sent += 1
+                    self.bytes += wire_size(message)
+                self._ready.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            logger.debug("Viewer send failed: %s", err)
+        logger.info("Viewer left after %s messages, %s frames dropped", self.sent, self.dropped)
+        if self._on_close:
+            self._on_close(self)
+
+    def close(self):
+        """Stop sending; pending messages are discarded."""
+        self._task.cancel()
@@ -1,10 +1,14 @@
-import asyncio
 import logging
 import math
 import random
+from collections import Counter, namedtuple
 
 from characters import DigDug, Direction, Fygar, Pooka, Rock
-from mapa import VITAL_SPACE, Map
+from clock import SKIP, FrameClock
+from codec import Static
+from delta import DeltaEncoder
+from mapa import VITAL_SPACE, Map, zobrist_key
+from profiler import FrameProfiler
 from consts import Smart, LIVES, TIMEOUT, MAX_LEN_ROPE, MIN_ENEMIES
 
 logger = logging.getLogger("Game")
@@ -14,6 +18,11 @@ INITIAL_SCORE = 0
 GAME_SPEED = 40
 MAP_SIZE = (48, 24)
 
+Snapshot = namedtuple(
+    "Snapshot",
+    ["counters", "map", "tiles", "rope", "characters", "schedule", "hashes", "rng"],
+)
+
 
 def level_enemies(level):
     level += MIN_ENEMIES
@@ -52,7 +61,7 @@ class Rope:
     def to_dict(self):
         return {"dir": self._dir, "pos": self._pos}
 
-    def shoot(self, pos, direction, _rocks, _enemies):
+    def shoot(self, pos, direction, _rocks, _fire):
         if self._dir and direction != self._dir:
             return self.__reset_rope()  # reset rope because digdug changed direction
 
@@ -67,10 +76,9 @@ class Rope:
         if new_pos in self._pos:  # we hit a wall
             return self.__reset_rope()
         
-        for e in _enemies:  # rope caught fire
-            if isinstance(e,Fygar) and e.fire and any(p in self._pos for p in e.fire):
-                return self.__reset_rope()
-            
+        if any(p in _fire for p in self._pos):  # rope caught fire
+            return self.__reset_rope()
+
         self._pos.append(new_pos)
 
         self._dir = direction
@@ -93,8 +101,82 @@ class Rope:
         return False
 
 
+class StateBuilder:
+    """Builds the per-frame state, reusing the same dicts from frame to frame.
+
+    Each enemy and rock keeps one record that only gets its changed fields
+    updated, and the enemies/rocks lists are rebuilt only when one is removed
+    or (for rocks) moves. The rocks list is a codec.Static, so it is also
+    serialized once per codec while no rock moves. The returned dict is
+    therefore overwritten by the next frame: copy it to keep a frame around.
+    """
+
+    def __init__(self):
+        self.state = {}
+        self._records = {}  # enemy or rock -> its dict in the state
+        self._enemies = None  # Game._enemies the enemies list was built from
+        self._rocks = None
+        self._rock_pos = None
+
+    def _record(self, entity):
+        if entity not in self._records:
+            self._records[entity] = entity.to_dict()
+        return self._records[entity]
+
+    def build(self, game):
+        state = self.state
+        state["level"] = game.map.level
+        state["step"] = game._step
+        state["timeout"] = game._timeout
+        state["player"] = game._player_name
+        state["score"] = game._score
+        state["lives"] = game._digdug.lives
+        state["digdug"] = game._digdug.pos
+
+        if game._enemies is not self._enemies:
+            if game._rocks is not self._rocks:  # new level
+                self._records = {}
+            self._enemies = game._enemies
+            state["enemies"] = [self._record(e) for e in game._enemies]
+        for e, record in zip(game._enemies, state["enemies"]):
+            record["pos"] = e.pos
+            record["dir"] = e.lastdir
+            if e.name == "Fygar" and e.fire:
+                record["fire"] = e.fire
+            else:
+                record.pop("fire", None)
+            if e.traverse:
+                record["traverse"] = e.traverse
+            else:
+                record.pop("traverse", None)
+
+        rock_pos = [r.pos for r in game._rocks]
+        if game._rocks is not self._rocks or rock_pos != self._rock_pos:
+            self._rocks, self._rock_pos = game._rocks, rock_pos
+            for r in game._rocks:
+                self._record(r)["pos"] = r.pos
+            state["rocks"] = Static(self._record(r) for r in game._rocks)
+
+        if game._rope.stretched:
+            rope = state.setdefault("rope", {})
+            rope["dir"] = game._rope._dir
+            rope["pos"] = game._rope._pos
+        else:
+            state.pop("rope", None)
+
+        return state
+
+
 class Game:
-    def __init__(self, level=1, lives=LIVES, timeout=TIMEOUT, size=MAP_SIZE):
+    def __init__(
+        self,
+        level=1,
+        lives=LIVES,
+        timeout=TIMEOUT,
+        size=MAP_SIZE,
+        delta=False,
+        tick_policy=SKIP,
+    ):
         logger.info(f"Game(level={level}, lives={lives})")
         self.initial_level = level
         self._running = False
@@ -103,9 +185,22 @@ class Game:
         self._step = 0
         self._total_steps = 0
         self._state = {}
+        self._builder = StateBuilder()
+        self._delta = DeltaEncoder() if delta else None
+        self.clock = FrameClock(GAME_SPEED, tick_policy)
+        self.profiler = FrameProfiler()
+        self.recorder = None  # gets the key of every frame, see replay.py
         self._initial_lives = lives
         self.map = Map(size=size, empty=True)
         self._enemies = []
+        self._wheel = {}  # frame -> enemies that act on that frame
+        self._last_tick = {}  # enemy -> frame of its last move
+        self._loose_rocks = set()  # rocks with an open passage below them
+        self._dug = 0  # how many of map.digged we have already looked at
+        self._fires = {}  # Fygar -> cells it is burning
+        self._fire = Counter()  # cell -> number of Fygars burning it
+        self._keys = {}  # entity -> its share of the Zobrist key
+        self._zobrist = 0
         self._rope = Rope(self.map)
         self.respawn = False
 
@@ -129,6 +224,16 @@ class Game:
         )
         return bonus_score
 
+    @property
+    def state(self):
+        """Full state of the last frame, even in delta mode."""
+        return self._state
+
+    @property
+    def zobrist(self):
+        """64-bit Zobrist key of digdug, enemies, rocks, rope and dug cells."""
+        return self._zobrist ^ self.map.zobrist
+
     @property
     def total_steps(self):
         return self._total_steps
@@ -166,7 +271,156 @@ class Game:
             for enemy, pos in zip(level_enemies(level), self.map.enemies_spawn)
         ]
         logger.debug("Enemies: %s", self._enemies)
+        self._order = {e: i for i, e in enumerate(self._enemies)}
+        self._wheel = {}
+        self._last_tick = {}
+        self._fires = {}
+        self._fire = Counter()
+        for e in self._enemies:
+            self._last_tick[e] = 0
+            self.schedule(e, 1)
         self._rocks = [Rock(p) for p in self.map.rocks_spawn]
+        self._rock_order = {r: i for i, r in enumerate(self._rocks)}
+        self._loose_rocks = {r for r in self._rocks if self.unsupported(r)}
+        self._dug = 0
+        self.rehash_all()
+        if self._delta:
+            self._delta.reset()  # every entity changed, start with a keyframe
+
+    def snapshot(self):
+        """Capture the whole simulation so it can be restored to fork lookaheads.
+
+        The tile grid is shared with the live map and copied column by column
+        on the next dig.
+        """
+        characters = [self._digdug, *self._enemies, *self._rocks]
+        return Snapshot(
+            (
+                self._running,
+                self._score,
+                self._step,
+                self._total_steps,
+                self._lastkeypress,
+                self.respawn,
+                self._dug,
+            ),
+            self.map,
+            self.map.snapshot(),
+            (self._rope, self._rope._pos.copy(), self._rope._dir),
+            (
+                tuple(self._enemies),
+                tuple(self._rocks),
+                [(c, c.snapshot()) for c in characters],
+            ),
+            (
+                {frame: due.copy() for frame, due in self._wheel.items()},
+                self._last_tick.copy(),
+                self._order.copy(),
+                self._rock_order,
+                self._loose_rocks.copy(),
+                self._fires.copy(),
+                self._fire.copy(),
+            ),
+            (self._keys.copy(), self._zobrist),
+            random.getstate(),
+        )
+
+    def restore(self, snapshot):
+        """Return the simulation to a state captured by snapshot()."""
+        (
+            self._running,
+            self._score,
+            self._step,
+            self._total_steps,
+            self._lastkeypress,
+            self.respawn,
+            self._dug,
+        ) = snapshot.counters
+        self.map = snapshot.map
+        self.map.restore(snapshot.tiles)
+        self._rope, pos, self._rope._dir = snapshot.rope
+        self._rope._pos = pos.copy()
+        enemies, rocks, characters = snapshot.characters
+        self._digdug = characters[0][0]
+        self._enemies = list(enemies)
+        self._rocks = list(rocks)
+        for character, state in characters:
+            character.restore(state)
+        wheel, last_tick, order, self._rock_order, loose, fires, fire = snapshot.schedule
+        self._wheel = {frame: due.copy() for frame, due in wheel.items()}
+        self._last_tick = last_tick.copy()
+        self._order = order.copy()
+        self._loose_rocks = loose.copy()
+        self._fires = fires.copy()
+        self._fire = fire.copy()
+        keys, self._zobrist = snapshot.hashes
+        self._keys = keys.copy()
+        random.setstate(snapshot.rng)
+
+    def entity_key(self, entity):
+        if entity == "rope":
+            key = zobrist_key("rope", -1 if self._rope._dir is None else int(self._rope._dir))
+            for i, (x, y) in enumerate(self._rope._pos):
+                key ^= zobrist_key("rope", i, x, y)
+            return key
+        if entity is self._digdug:
+            return zobrist_key("digdug", *entity.pos, int(entity.direction))
+        if isinstance(entity, Rock):
+            return zobrist_key("rock", *entity.pos)
+        return zobrist_key("enemy", self._order[entity], *entity.pos, entity._alive)
+
+    def rehash(self, *entities):
+        """Update the Zobrist key after entities (or "rope") changed."""
+        for entity in entities:
+            key = self.entity_key(entity)
+            self._zobrist ^= self._keys.get(entity, 0) ^ key
+            self._keys[entity] = key
+
+    def unhash(self, entity):
+        self._zobrist ^= self._keys.pop(entity)
+
+    def rehash_all(self):
+        self._keys = {}
+        self._zobrist = 0
+        self.rehash(self._digdug, *self._enemies, *self._rocks, "rope")
+
+    def schedule(self, enemy, frame):
+        """Wake enemy up on the given frame."""
+        self._wheel.setdefault(frame, []).append(enemy)
+
+    def due_enemies(self):
+        """Enemies that act on the current frame, in spawn order."""
+        due = self._wheel.pop(self._step, [])
+        return sorted(
+            (e for e in due if e.alive and not e.exit), key=self._order.__getitem__
+        )
+
+    def update_fire(self, enemies):
+        """Refresh the fire coverage from the given enemies' fire."""
+        changed = False
+        for e in enemies:
+            fire = tuple(e.fire) if isinstance(e, Fygar) and e in self._order else ()
+            if self._fires.get(e, ()) != fire:
+                changed = True
+                if fire:
+                    self._fires[e] = fire
+                else:
+                    del self._fires[e]
+        if changed:
+            self._fire = Counter(p for cells in self._fires.values() for p in cells)
+
+    def unsupported(self, rock):
+        """Whether there is an open passage right below the rock."""
+        return self.map.calc_pos(rock.pos, Direction.SOUTH, traverse=False) != rock.pos
+
+    def loosen_rocks(self):
+        """Add rocks that lost the stone below them since the last call."""
+        digged = self.map.digged
+        if self._dug == len(digged):
+            return
+        above = {(x, y - 1) for x, y in digged[self._dug :]}
+        self._dug = len(digged)
+        self._loose_rocks.update(r for r in self._rocks if r.pos in above)
 
     def quit(self):
         logger.debug("Quit")
@@ -183,9 +437,10 @@ class Game:
                 # Parse action
                 if self._lastkeypress in "AB":
                     self._rope.shoot(
-                        self._digdug.pos, self._digdug.direction, self._rocks, self._enemies
+                        self._digdug.pos, self._digdug.direction, self._rocks, self._fire
                     )
                     if self._rope.hit(self._enemies):
+                        self.rehash(*self._enemies)
                         logger.debug(
                             "[step=%s] Enemy hit with rope(%s) - enemies: %s - digdug: %s",
                             self._step,
@@ -212,6 +467,7 @@ class Game:
             )
         finally:
             self._lastkeypress = ""  # remove inertia
+        self.rehash(self._digdug, "rope")
 
         if len(self._enemies) == 0:
             logger.info(f"Level {self.map.level} completed")
@@ -241,42 +497,61 @@ class Game:
             not self._running
         ):  # if game is not running, we don't need to check collisions
             return
+        occupied = {}  # cell -> enemies standing on it
         for e in self._enemies:
-            if e.pos == self._digdug.pos:
-                logger.debug("[step=%s] %s has killed %s", self._step, e, self._digdug)
-                self.kill_digdug()
-                e.respawn()
-            if e._name == "Fygar" and e.fire:
-                if self._digdug.pos in e.fire:
-                    logger.debug(
-                        "[step=%s] %s has killed %s with fire",
-                        self._step,
-                        e,
-                        self._digdug,
-                    )
-                    self.kill_digdug()
+            occupied.setdefault(e.pos, []).append(e)
+
+        for e in occupied.pop(self._digdug.pos, []):
+            logger.debug("[step=%s] %s has killed %s", self._step, e, self._digdug)
+            self.kill_digdug()
+            e.respawn()
+            self.rehash(e)
+            occupied.setdefault(e.pos, []).append(e)
+        for _ in range(self._fire[self._digdug.pos]):
+            logger.debug(
+                "[step=%s] %s has been killed with fire", self._step, self._digdug
+            )
+            self.kill_digdug()
         for r in self._rocks:
             if r.pos == self._digdug.pos:
                 logger.debug("[step=%s] %s has killed %s", self._step, r, self._digdug)
                 self.kill_digdug()
-            for e in self._enemies:
-                if r.pos == e.pos:
-                    e.kill(rock=True)
-                    self._score += e.points(self.map.ver_tiles)
+            for e in occupied.get(r.pos, []):
+                e.kill(rock=True)
+                self.rehash(e)
+                self._score += e.points(self.map.ver_tiles)
 
     async def next_frame(self):
-        await asyncio.sleep(1.0 / GAME_SPEED)
+        self.profiler.begin()
+        await self.clock.tick()
+        self.profiler.mark("sleep")
+        return self.step()
+
+    def step(self, key=None):
+        """Advance exactly one frame, without pacing, and return the new state.
+
+        In delta mode (see delta.py) the changes since the previous frame are
+        returned instead.
+        """
+        if key is not None:
+            self.keypress(key)
 
         if not self._running:
             logger.info("Waiting for player 1")
             return
 
+        prof = self.profiler
+        prof.begin()
+        if self.recorder is not None:
+            self.recorder.record(self._lastkeypress)
         if self.respawn:
             self._digdug.respawn()
+            self.rehash(self._digdug)
             for e in self._enemies:
                 if math.dist(self._digdug.pos, e.pos) < VITAL_SPACE:
                     logger.debug("respawn camper")
                     e.respawn()
+                    self.rehash(e)
             self.respawn = False
 
         self._step += 1
@@ -289,14 +564,30 @@ class Game:
             )
 
         if not self.update_digdug():
+            prof.mark("step;next_level")
             return  # if update_digdug returns false, we have a new level and we stop right here
+        prof.mark("step;update_digdug")
 
         self.collision()
+        prof.mark("step;collision1")
 
-        for enemy in self._enemies:
-            if enemy.alive:
-                enemy.move(self.map, self._digdug, self._enemies, self._rocks)
+        due = self.due_enemies()
+        for enemy in due:
+            enemy.move(
+                self.map,
+                self._digdug,
+                self._enemies,
+                self._rocks,
+                frames=self._step - self._last_tick[enemy],
+            )
+            self._last_tick[enemy] = self._step
+            self.rehash(enemy)
+            self.schedule(
+                enemy, self._step + (enemy.frames_to_ready() if enemy.idle else 1)
+            )
+        prof.mark("step;enemies")
         if self._rope.stretched and self._rope.hit(self._enemies):
+            self.rehash(*self._enemies, "rope")
             logger.debug(
                 "[step=%s] Enemy hit with rope(%s) - enemies: %s - digdug: %s",
                 self._step,
@@ -304,41 +595,40 @@ class Game:
                 self._enemies,
                 self._digdug,
             )
- 
-        for rock in self._rocks:
+        prof.mark("step;rope")
+
+        self.loosen_rocks()
+        for rock in sorted(self._loose_rocks, key=self._rock_order.__getitem__):
             rock.move(self.map, digdug=self._digdug, rocks=self._rocks)
+            self.rehash(rock)
+            if not self.unsupported(rock):
+                self._loose_rocks.discard(rock)
+        prof.mark("step;rocks")
 
         self._score += sum(
             [e.points(self.map.ver_tiles) for e in self._enemies if not e.alive]
         )
-        self._enemies = [
-            e for e in self._enemies if e.alive and not e.exit
-        ]  # remove dead and exited enemies
+        gone = [e for e in self._enemies if not e.alive or e.exit]
+        if gone:
+            self._enemies = [
+                e for e in self._enemies if e.alive and not e.exit
+            ]  # remove dead and exited enemies
+            for e in gone:
+                self.unhash(e)
+                del self._order[e], self._last_tick[e]
+        self.update_fire(due + gone)
+        prof.mark("step;cleanup")
 
         self.collision()
+        prof.mark("step;collision2")
 
-        self._state = {
-            "level": self.map.level,
-            "step": self._step,
-            "timeout": self._timeout,
-            "player": self._player_name,
-            "score": self._score,
-            "lives": self._digdug.lives,
-            "digdug": self._digdug.pos,
-            "enemies": [],
-            "rocks": [r.to_dict() for r in self._rocks],
-        }
-
-        for e in self._enemies:
-            self._state["enemies"].append(e.to_dict())
-            if e.name == "Fygar" and e.fire:
-                self._state["enemies"][-1]["fire"] = e.fire
-            if e.traverse:
-                self._state["enemies"][-1]["traverse"] = e.traverse
-
-        if self._rope.stretched:
-            self._state["rope"] = self._rope.to_dict()
+        self._state = self._builder.build(self)
+        prof.mark("step;state")
 
+        if self._delta:
+            delta = self._delta.encode(self._state)
+            prof.mark("step;delta")
+            return delta
         return self._state
 
     def info(self):
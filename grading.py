@@ -0,0 +1,125 @@
+"""Background submission of game results to the grading server."""
+import asyncio
+import json
+import logging
+import os
+import uuid
+
+import requests
+from requests import RequestException
+
+logger = logging.getLogger("Grading")
+logger.setLevel(logging.INFO)
+
+SPOOL_FILE = "grading.spool"
+BATCH = 20  # records sent per wake-up
+TIMEOUT = 2  # seconds per request
+MIN_BACKOFF = 1
+MAX_BACKOFF = 300
+
+
+class GradingQueue:
+    """Submits game records without blocking the event loop, and never loses them.
+
+    submit() appends the record to a spool file (one JSON line each) and
+    queues it. run() posts queued records from a worker thread, in batches
+    over one HTTP connection, and appends {"ack": id} lines for the ones
+    the server took. Failed batches are retried with exponential backoff.
+    Records still in the spool when the server stops are sent on the next
+    start, after the spool is compacted.
+    """
+
+    def __init__(self, url, spool=SPOOL_FILE, batch=BATCH, timeout=TIMEOUT):
+        self.url = url
+        self.batch = batch
+        self.timeout = timeout
+        self.sent = 0
+        self.failures = 0
+        self._spool = spool
+        self._pending = self._replay()
+        self._wakeup = asyncio.Event()
+        self._http = requests.Session()
+        self._file = open(spool, "a")
+        if self._pending:
+            logger.info("%s game records left to submit from %s", len(self._pending), spool)
+
+    def _replay(self):
+        """Records of the spool without an ack, rewriting it with only those."""
+        if not os.path.isfile(self._spool):
+            return []
+        records, acked = {}, set()
+        with open(self._spool) as infile:
+            for line in infile:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn last line from a crash
+                if "ack" in entry:
+                    acked.add(entry["ack"])
+                else:
+                    records[entry["id"]] = entry
+        pending = [r for id_, r in records.items() if id_ not in acked]
+
+        tmp = self._spool + ".tmp"
+        with open(tmp, "w") as outfile:
+            outfile.writelines(json.dumps(r) + "\n" for r in pending)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(tmp, self._spool)
+        return pending
+
+    def _append(self, entries):
+        self._file.writelines(json.dumps(e) + "\n" for e in entries)
+        self._file.flush()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def submit(self, record):
+        entry = {"id": uuid.uuid4().hex, "record": record}
+        self._append([entry])
+        self._pending.append(entry)
+        self._wakeup.set()
+
+    def _post(self, entries):
+        """Send entries in order, return how many the server took."""
+        for done, entry in enumerate(entries):
+            try:
+                response = self._http.post(self.url, json=entry["record"], timeout=self.timeout)
+            except RequestException as err:
+                logger.warning("Could not submit score: %s", err)
+                return done
+            if response.status_code >= 500:
+                logger.warning("Grading server error %s", response.status_code)
+                return done
+            if response.status_code >= 400:
+                logger.error("Score rejected (%s): %s", response.status_code, entry["record"])
+        return len(entries)
+
+    async def run(self):
+        """Worker: post pending records until cancelled."""
+        backoff = MIN_BACKOFF
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+
+            batch = self._pending[: self.batch]
+            done = await asyncio.to_thread(self._post, batch)
+            if done:
+                self._append([{"ack": e["id"]} for e in batch[:done]])
+                del self._pending[:done]
+                self.sent += done
+            if done < len(batch):
+                self.failures += 1
+                logger.info("Retrying %s game records in %ss", len(self._pending), backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+            else:
+                backoff = MIN_BACKOFF
+
+    def close(self):
+        """Make the spool durable and let go of the file and HTTP session."""
+        os.fsync(self._file.fileno())  # _append() already flushed
+        self._file.close()
+        self._http.close()
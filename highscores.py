@@ -0,0 +1,88 @@
+"""Best scores, kept in memory and written to disk off the event loop."""
+import asyncio
+import heapq
+import json
+import logging
+import os
+
+logger = logging.getLogger("Highscores")
+logger.setLevel(logging.INFO)
+
+HIGHSCORE_FILE = "highscores.json"
+MAX_HIGHSCORES = 10
+FLUSH_DELAY = 1.0  # seconds to gather scores into one write
+
+
+class Highscores:
+    """The MAX_HIGHSCORES best (name, score) pairs.
+
+    Scores live in a min-heap, so add() is O(log n) and never touches the
+    disk. It schedules a flush after FLUSH_DELAY, and every score added
+    meanwhile goes out in that same write. The file is written in a worker
+    thread to a temporary file that is then renamed over the old one, so a
+    crash leaves either the old or the new list. On equal scores the
+    older entry ranks first and stays.
+    """
+
+    def __init__(self, path=HIGHSCORE_FILE, size=MAX_HIGHSCORES, delay=FLUSH_DELAY):
+        self.path = path
+        self.size = size
+        self.delay = delay
+        self.writes = 0
+        self._heap = []  # (score, -n, name), n counts entries in arrival order
+        self._count = 0
+        self._flush = None
+        self._writing = asyncio.Lock()
+
+        if os.path.isfile(path):
+            with open(path, "r") as infile:
+                for name, score in json.load(infile):
+                    self._push(name, score)
+
+    def _push(self, name, score):
+        self._count += 1
+        entry = (score, -self._count, name)
+        if len(self._heap) < self.size:
+            heapq.heappush(self._heap, entry)
+        elif score > self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
+        else:
+            return False
+        return True
+
+    def top(self):
+        """Best first, as the list stored in the file."""
+        return [(name, score) for score, _, name in sorted(self._heap, reverse=True)]
+
+    def add(self, name, score):
+        logger.info("Saving: %s <%s>", name, score)
+        if self._push(name, score) and self._flush is None:
+            self._flush = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.delay)
+        self._flush = None
+        await self.flush()
+
+    async def flush(self):
+        async with self._writing:
+            await asyncio.to_thread(self._write, self.top())
+
+    def close(self):
+        """Write a pending flush now, on shutdown."""
+        if self._flush is not None:
+            self._flush.cancel()
+            self._flush = None
+            self._write(self.top())
+
+    def _write(self, scores):
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as outfile:
+                json.dump(scores, outfile)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            os.replace(tmp, self.path)
+            self.writes += 1
+        except OSError as err:
+            logger.error("Could not save highscores: %s", err)
@@ -0,0 +1,92 @@
+"""How long a player takes to answer a frame, and what becomes of its keys."""
+import logging
+from collections import Counter
+from time import perf_counter_ns
+
+from profiler import FrameProfiler
+
+logger = logging.getLogger("Latency")
+logger.setLevel(logging.INFO)
+
+WINDOW = 1000  # keys kept for the percentiles
+SENT_WINDOW = 256  # frames we remember the send time of
+
+
+class InputLatency:
+    """Follows one player's keys from the frame they answer to the step using them.
+
+    The server numbers the frames it sends ("frame" in the state) and clients
+    echo the number in their key message ({"cmd": "key", "key": "d",
+    "frame": 41}). Two timings are kept, with FrameProfiler's percentiles
+    and histograms:
+
+    - "reply": from sending the frame to receiving the key;
+    - "applied": from sending the frame to the step that used the key.
+
+    frames_behind counts applied keys by how many frames the game had moved
+    since the frame they answer (1 is as fast as it gets). A key is late
+    when a newer frame was already out when it arrived, overwritten when
+    another key replaced it before a step (Game.keypress keeps only the
+    last), and dropped when the game ended first. Keys without a known
+    frame number are only counted as unlabelled.
+    """
+
+    def __init__(self, window=WINDOW):
+        self.timings = FrameProfiler(enabled=True, window=window)
+        self.frames_behind = Counter()
+        self.keys = 0
+        self.late = 0
+        self.overwritten = 0
+        self.dropped = 0
+        self.unlabelled = 0
+        self._sent = {}  # frame -> perf_counter_ns() when sent
+        self._frame = 0  # last frame sent
+        self._pending = None  # (key, frame it answers) until a step uses it
+
+    def sent(self, frame):
+        self._frame = frame
+        self._sent[frame] = perf_counter_ns()
+        self._sent.pop(frame - SENT_WINDOW, None)
+
+    def received(self, key, frame=None):
+        now = perf_counter_ns()
+        self.keys += 1
+        if self._pending and self._pending[0]:
+            self.overwritten += 1
+
+        if frame not in self._sent:
+            self.unlabelled += 1
+            frame = None
+        else:
+            if frame < self._frame:
+                self.late += 1
+            self.timings.record("reply", now - self._sent[frame])
+        self._pending = (key, frame)
+
+    def applied(self, frame):
+        """The game computed frame, using the pending key if there is one."""
+        if self._pending is None:
+            return
+        _, answered = self._pending
+        self._pending = None
+        if answered in self._sent:
+            self.timings.record("applied", perf_counter_ns() - self._sent[answered])
+            self.frames_behind[frame - answered] += 1
+
+    def close(self):
+        """The game is over, a key still waiting is lost."""
+        if self._pending and self._pending[0]:
+            self.dropped += 1
+        self._pending = None
+
+    def to_dict(self):
+        return {
+            "keys": self.keys,
+            "late": self.late,
+            "overwritten": self.overwritten,
+            "dropped": self.dropped,
+            "unlabelled": self.unlabelled,
+            # string keys, as JSON would make them anyway (msgpack refuses ints)
+            "frames_behind": {str(n): count for n, count in sorted(self.frames_behind.items())},
+            "timings": self.timings.to_dict(),
+        }
@@ -1,12 +1,55 @@
+import base64
+import hashlib
 import logging
 import random
 from enum import IntEnum
+from functools import lru_cache
 
 from consts import Direction, Tiles, VITAL_SPACE, MIN_CORRIDOR_LEN
 
 logger = logging.getLogger("Map")
 logger.setLevel(logging.INFO)
 
+ZOBRIST_CACHE = 1 << 16  # keys kept; a map has ~1200 tiles, a game a few kinds per tile
+
+
+@lru_cache(maxsize=ZOBRIST_CACHE)
+def zobrist_key(*feature):
+    """Stable pseudo-random 64-bit number for a state feature, for Zobrist hashing.
+
+    Derived from the feature itself so keys agree across processes and never
+    touch the game's random module state. Features are a kind and a few small
+    numbers (a position, an index), and an evicted key is simply derived again.
+    """
+    digest = hashlib.blake2b(repr(feature).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def pack_tiles(tiles):
+    """Tile grid as a bitmask: one bit per tile, column by column, 1 for stone.
+
+    Bit i of the result (byte i // 8, bit i % 8) is tile (i // height, i % height).
+    """
+    bits = "".join("1" if tile == Tiles.STONE else "0" for column in tiles for tile in column)
+    return int(bits[::-1] or "0", 2).to_bytes((len(bits) + 7) // 8, "little")
+
+
+def unpack_tiles(data, size):
+    """Tile grid from pack_tiles() output, raw or base64 (as sent in JSON).
+
+    A map that was not packed (a list of columns) is returned as is.
+    """
+    if isinstance(data, list):
+        return data
+    if isinstance(data, str):
+        data = base64.b64decode(data)
+    hor_tiles, ver_tiles = size
+    bits = int.from_bytes(data, "little")
+    return [
+        [Tiles((bits >> (x * ver_tiles + y)) & 1) for y in range(ver_tiles)]
+        for x in range(hor_tiles)
+    ]
+
 
 class Map:
     def __init__(
@@ -27,6 +70,9 @@ class Map:
         self.ver_tiles = size[1]
         self._rocks = rocks
         self._digged = []
+        self._shared = set()  # columns shared with a snapshot
+        self._digged_shared = False
+        self._reach = {}  # (row or column, direction) -> {(pos, length): cells}
         if enemies_spawn:
             self._enemies_spawn = enemies_spawn
         else:
@@ -85,12 +131,59 @@ class Map:
             self.map = mapa
 
         self._digdug_spawn = (1, 1)  # Always true
+        self._zobrist = self._hash_tiles()
 
     def __getstate__(self):
-        return self.map
+        state = self.__dict__.copy()
+        del state["_reach"], state["_shared"]  # cache and copy-on-write flags
+        state["_digged_shared"] = False
+        return state
 
     def __setstate__(self, state):
-        self.map = state
+        if isinstance(state, dict):
+            self.__dict__.update(state)
+        else:  # older pickles only kept the tiles
+            self.map = state
+            self._zobrist = self._hash_tiles()
+        self._shared = set()
+        self._digged_shared = False
+        self._reach = {}
+
+    def _hash_tiles(self):
+        key = 0
+        for x, column in enumerate(self.map):
+            for y, tile in enumerate(column):
+                if tile == Tiles.PASSAGE:
+                    key ^= zobrist_key("passage", x, y)
+        return key
+
+    @property
+    def zobrist(self):
+        """64-bit Zobrist key of the passages, updated on every dig."""
+        return self._zobrist
+
+    def snapshot(self):
+        """Capture the tiles and digging state; columns are copied on write."""
+        self._shared = set(range(self.hor_tiles))
+        self._digged_shared = True
+        return (
+            tuple(self.map),
+            self._digged,
+            dict(self._reach),
+            self._level,
+            self._zobrist,
+        )
+
+    def restore(self, snapshot):
+        columns, self._digged, reach, self._level, self._zobrist = snapshot
+        self.map = list(columns)
+        self._reach = dict(reach)
+        self._shared = set(range(self.hor_tiles))
+        self._digged_shared = True
+
+    def freeze(self):
+        """Immutable copy of the tiles, see FrozenMap."""
+        return FrozenMap(self.map, self._size)
 
     @property
     def size(self):
@@ -127,8 +220,17 @@ class Map:
     def dig(self, pos):
         x, y = pos
         if self.map[x][y] == Tiles.STONE:
+            if x in self._shared:
+                self.map[x] = self.map[x].copy()
+                self._shared.discard(x)
+            if self._digged_shared:
+                self._digged = self._digged.copy()
+                self._digged_shared = False
             self.map[x][y] = Tiles.PASSAGE
             self._digged.append((x, y))
+            self._zobrist ^= zobrist_key("passage", x, y)
+            for direction in Direction:
+                self._reach.pop(self._line(pos, direction), None)
 
     def is_blocked(self, pos, traverse):
         x, y = pos
@@ -143,6 +245,29 @@ class Map:
                 return True
         assert False, "Unknown tile type"
 
+    def _line(self, pos, direction):
+        if direction in [Direction.EAST, Direction.WEST]:
+            return pos[1], direction
+        return pos[0], direction
+
+    def reach(self, pos, direction: Direction, length):
+        """Cells a straight line from pos covers before hitting stone, at most length.
+
+        Results are cached per row/column and dropped when that line is dug.
+        """
+        cache = self._reach.setdefault(self._line(pos, direction), {})
+        if (pos, length) not in cache:
+            cells = []
+            cur = pos
+            for _ in range(length):
+                npos = self.calc_pos(cur, direction, traverse=False)
+                if npos == cur:
+                    break
+                cells.append(npos)
+                cur = npos
+            cache[pos, length] = tuple(cells)
+        return cache[pos, length]
+
     def calc_pos(self, cur, direction: Direction, traverse=True):
         cx, cy = cur
         npos = cur
@@ -160,3 +285,50 @@ class Map:
             return cur
 
         return npos
+
+
+class FrozenMap:
+    """Immutable, hashable tile grid for planning over digs.
+
+    dig() returns a new FrozenMap that shares every column but the dug one,
+    so a search tree over dig plans only pays for the columns it changed.
+    """
+
+    def __init__(self, mapa, size, _hashes=None):
+        self._size = size
+        self.hor_tiles, self.ver_tiles = size
+        self.map = tuple(tuple(column) for column in mapa)
+        self._hashes = _hashes or tuple(hash(column) for column in self.map)
+        self._hash = hash(self._hashes)
+
+    @property
+    def size(self):
+        return self._size
+
+    def dig(self, pos):
+        x, y = pos
+        column = self.map[x]
+        if column[y] != Tiles.STONE:
+            return self
+
+        column = column[:y] + (Tiles.PASSAGE,) + column[y + 1 :]
+        new = FrozenMap.__new__(FrozenMap)
+        new._size = self._size
+        new.hor_tiles, new.ver_tiles = self._size
+        new.map = self.map[:x] + (column,) + self.map[x + 1 :]
+        new._hashes = self._hashes[:x] + (hash(column),) + self._hashes[x + 1 :]
+        new._hash = hash(new._hashes)
+        return new
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if not isinstance(other, FrozenMap):
+            return NotImplemented
+        return self._hash == other._hash and self.map == other.map
+
+    # same read-only queries as Map
+    get_tile = Map.get_tile
+    is_blocked = Map.is_blocked
+    calc_pos = Map.calc_pos
@@ -0,0 +1,129 @@
+"""Minimal Prometheus metrics: counters, gauges, histograms and a /metrics endpoint.
+
+Updating a metric is an attribute increment or a bisect, cheap enough for
+every frame. Gauges are read from a callback only when scraped.
+"""
+import asyncio
+import bisect
+import logging
+
+logger = logging.getLogger("Metrics")
+logger.setLevel(logging.INFO)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# 100us .. ~1.6s, for frame, encode and lag timings
+TIME_BUCKETS = tuple(0.0001 * 2**i for i in range(15))
+# 64B .. 256KB
+SIZE_BUCKETS = tuple(64 * 2**i for i in range(13))
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, self.value
+
+
+class Gauge:
+    """Value read when scraped; kind="counter" for totals kept elsewhere."""
+
+    def __init__(self, name, help, read, kind="gauge"):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.kind = kind
+
+    def samples(self):
+        yield self.name, self.read()
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield f'{self.name}_bucket{{le="{bound:g}"}}', total
+        yield f'{self.name}_bucket{{le="+Inf"}}', self.count
+        yield f"{self.name}_sum", self.sum
+        yield f"{self.name}_count", self.count
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help):
+        return self._add(Counter(name, help))
+
+    def gauge(self, name, help, read, kind="gauge"):
+        return self._add(Gauge(name, help, read, kind))
+
+    def histogram(self, name, help, buckets=TIME_BUCKETS):
+        return self._add(Histogram(name, help, buckets))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name} {_number(value)}" for name, value in metric.samples())
+        return "\n".join(lines) + "\n"
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass  # headers
+            parts = request.split()
+            if len(parts) > 1 and parts[1].split(b"?")[0] == b"/metrics":
+                status, body = "200 OK", self.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not found, try /metrics\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        """Answer GET /metrics on host:port; returns the asyncio server."""
+        server = await asyncio.start_server(self._handle, host, port)
+        logger.info("Metrics @ http://%s:%s/metrics", host or "0.0.0.0", port)
+        return server
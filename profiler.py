@@ -0,0 +1,97 @@
+"""Per-phase frame timings, cheap enough to leave in the game loop."""
+import json
+import logging
+from collections import deque
+from time import perf_counter_ns
+
+logger = logging.getLogger("Profiler")
+logger.setLevel(logging.INFO)
+
+WINDOW = 1000  # frames kept per phase
+
+
+def _percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class FrameProfiler:
+    """Records how long each phase of a frame took.
+
+    begin() starts the clock and every mark(phase) charges the time since the
+    previous mark to that phase. Phase names use ";" to nest, as in flame
+    graphs ("step;collision1"). When disabled, mark() returns at once.
+    """
+
+    def __init__(self, enabled=False, window=WINDOW):
+        self.window = window
+        self._samples = {}  # phase -> deque of durations in ns
+        self._last = perf_counter_ns()
+        self._enabled = enabled
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, value):
+        self._last = perf_counter_ns()
+        self._enabled = value
+
+    def toggle(self):
+        self.enabled = not self._enabled
+        logger.info("Frame profiler %s", "on" if self._enabled else "off")
+
+    def reset(self):
+        self._samples = {}
+
+    def begin(self):
+        if self._enabled:
+            self._last = perf_counter_ns()
+
+    def mark(self, phase):
+        if not self._enabled:
+            return
+        now = perf_counter_ns()
+        self.record(phase, now - self._last)
+        self._last = now
+
+    def record(self, phase, ns):
+        """Add a duration measured elsewhere to phase."""
+        samples = self._samples.get(phase)
+        if samples is None:
+            samples = self._samples[phase] = deque(maxlen=self.window)
+        samples.append(ns)
+
+    def histogram(self, phase):
+        """Sample counts per power-of-two bucket, keyed by upper bound in us."""
+        buckets = {}
+        for ns in self._samples.get(phase, ()):
+            bound = 1
+            while bound * 1000 < ns:
+                bound *= 2
+            buckets[bound] = buckets.get(bound, 0) + 1
+        return dict(sorted(buckets.items()))
+
+    def to_dict(self):
+        report = {}
+        for phase, samples in self._samples.items():
+            ordered = sorted(samples)
+            report[phase] = {
+                "count": len(ordered),
+                "mean_us": sum(ordered) / len(ordered) / 1000,
+                "p50_us": _percentile(ordered, 0.5) / 1000,
+                "p99_us": _percentile(ordered, 0.99) / 1000,
+                "max_us": ordered[-1] / 1000,
+                "histogram_us": {str(us): n for us, n in self.histogram(phase).items()},
+            }
+        return report
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def folded(self):
+        """Total time per phase in the folded-stack format of flamegraph.pl."""
+        return "".join(
+            f"tick;{phase} {sum(samples) // 1000}\n"
+            for phase, samples in self._samples.items()
+        )
@@ -0,0 +1,274 @@
+"""Compact game recordings: seed and settings, then one byte per frame.
+
+Games are deterministic given the random seed and the key applied on each
+frame, so that is all a replay stores. Re-simulating uses the headless
+Game.step() and runs thousands of frames per second.
+
+File layout (little endian):
+    header  "DDRP", version u8, seed u64, level u16, lives u8, timeout u32,
+            player name length u8, player name (utf-8)
+    frames  one byte per frame, the index of the key in KEYS
+
+Seekable recordings ("DDRX") have the same header followed by a u32
+keyframe interval N, the frame bytes, then a zlib-compressed pickle of
+Game.snapshot() taken every N frames. A footer lists each keyframe's frame,
+offset and size, and the file ends with the keyframe count, the footer
+offset and "DDRX". Reaching any frame then takes at most N steps. Keyframes
+are pickles, so only open recordings you trust.
+"""
+import argparse
+import bisect
+import json
+import logging
+import mmap
+import os
+import pickle
+import random
+import struct
+import zlib
+from datetime import datetime
+
+from game import Game
+
+logger = logging.getLogger("Replay")
+logger.setLevel(logging.INFO)
+
+MAGIC = b"DDRP"
+REPLAY_VERSION = 1
+HEADER = struct.Struct("<4sBQHBIB")
+SEEKABLE_MAGIC = b"DDRX"
+INTERVAL = struct.Struct("<I")
+INDEX_ENTRY = struct.Struct("<IQI")  # frame, offset, size
+TRAILER = struct.Struct("<IQ4s")  # keyframes, footer offset, magic
+KEYFRAME_INTERVAL = 200
+KEYS = ["", "w", "a", "s", "d", "A", "B"]  # anything else does nothing
+KEY_CODES = {k: i for i, k in enumerate(KEYS)}
+
+
+class ReplayRecorder:
+    """Collects the key of every frame of a game, see Game.recorder."""
+
+    def __init__(self, seed, level, lives, timeout, player):
+        self.seed = seed
+        self.level = level
+        self.lives = lives
+        self.timeout = timeout
+        self.player = player
+        self.keys = bytearray()
+
+    def record(self, key):
+        self.keys.append(KEY_CODES.get(key, 0))
+
+    def to_bytes(self):
+        name = self.player.encode()[:255]
+        header = HEADER.pack(
+            MAGIC,
+            REPLAY_VERSION,
+            self.seed,
+            self.level,
+            self.lives,
+            self.timeout,
+            len(name),
+        )
+        return header + name + bytes(self.keys)
+
+    def save(self, path):
+        logger.info("Saving replay of %s frames to %s", len(self.keys), path)
+        with open(path, "wb") as outfile:
+            outfile.write(self.to_bytes())
+
+
+class KeyframeRecorder(ReplayRecorder):
+    """ReplayRecorder that also keeps a Game snapshot every `interval` frames.
+
+    Snapshots share storage with the live game and are only pickled by
+    to_bytes(), so recording stays cheap.
+    """
+
+    def __init__(self, game, seed, level, lives, timeout, player, interval=KEYFRAME_INTERVAL):
+        super().__init__(seed, level, lives, timeout, player)
+        self.game = game
+        self.interval = interval
+        self.keyframes = []  # (frame, Game.snapshot())
+
+    def record(self, key):
+        frame = len(self.keys)
+        if frame % self.interval == 0:
+            self.keyframes.append((frame, self.game.snapshot()))
+        super().record(key)
+
+    def to_bytes(self):
+        name = self.player.encode()[:255]
+        data = bytearray(
+            HEADER.pack(
+                SEEKABLE_MAGIC,
+                REPLAY_VERSION,
+                self.seed,
+                self.level,
+                self.lives,
+                self.timeout,
+                len(name),
+            )
+        )
+        data += name + INTERVAL.pack(self.interval) + self.keys
+
+        index = []
+        for frame, snapshot in self.keyframes:
+            blob = zlib.compress(pickle.dumps(snapshot, pickle.HIGHEST_PROTOCOL))
+            index.append(INDEX_ENTRY.pack(frame, len(data), len(blob)))
+            data += blob
+        footer = len(data)
+        data += b"".join(index)
+        data += TRAILER.pack(len(index), footer, SEEKABLE_MAGIC)
+        return bytes(data)
+
+
+def new_recorder(game, seed, player, keyframes=0):
+    """Recorder for a game about to start, seekable if keyframes > 0."""
+    settings = (seed, game.initial_level, game._initial_lives, game._timeout, player)
+    if keyframes > 0:
+        return KeyframeRecorder(game, *settings, interval=keyframes)
+    return ReplayRecorder(*settings)
+
+
+def save_replay(directory, recorder):
+    """Store a recording in directory, named after its date and player."""
+    os.makedirs(directory, exist_ok=True)
+    name = "".join(c if c.isalnum() else "_" for c in recorder.player)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    ext = "ddrx" if isinstance(recorder, KeyframeRecorder) else "ddrp"
+    try:
+        recorder.save(os.path.join(directory, f"{stamp}-{name}.{ext}"))
+    except OSError as err:
+        logger.error("Could not save replay: %s", err)
+
+
+class Replay:
+    """A recorded game that can be re-simulated to any frame."""
+
+    def __init__(self, seed, level, lives, timeout, player, keys):
+        self.seed = seed
+        self.level = level
+        self.lives = lives
+        self.timeout = timeout
+        self.player = player
+        self.keys = keys
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version, seed, level, lives, timeout, length = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a replay file")
+        if version != REPLAY_VERSION:
+            raise ValueError(f"Unsupported replay version {version}")
+        start = HEADER.size + length
+        player = data[HEADER.size : start].decode()
+        return cls(seed, level, lives, timeout, player, bytes(data[start:]))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as infile:
+            return cls.from_bytes(infile.read())
+
+    def __len__(self):
+        return len(self.keys)
+
+    def new_game(self):
+        """The game as the server started it, before its first frame."""
+        random.seed(self.seed)
+        game = Game(self.level, self.lives, self.timeout)
+        game.start(self.player)
+        return game
+
+    def seek(self, frame, game=None):
+        """Game after the first `frame` frames; pass a game to continue it."""
+        game = game or self.new_game()
+        played = game.total_steps + game._step if game.running else len(self)
+        for code in self.keys[played:frame]:
+            game.step(KEYS[code])
+        return game
+
+    def play(self):
+        """Play the whole recording and return the finished game."""
+        return self.seek(len(self))
+
+
+class KeyframeReplay(Replay):
+    """A seekable recording, read through mmap."""
+
+    def __init__(self, data):
+        magic, version, seed, level, lives, timeout, length = HEADER.unpack_from(data)
+        if magic != SEEKABLE_MAGIC:
+            raise ValueError("Not a seekable replay file")
+        if version != REPLAY_VERSION:
+            raise ValueError(f"Unsupported replay version {version}")
+        start = HEADER.size + length
+        player = bytes(data[HEADER.size : start]).decode()
+        (self.interval,) = INTERVAL.unpack_from(data, start)
+        start += INTERVAL.size
+
+        count, footer, _ = TRAILER.unpack_from(data, len(data) - TRAILER.size)
+        self._index = [
+            INDEX_ENTRY.unpack_from(data, footer + i * INDEX_ENTRY.size)
+            for i in range(count)
+        ]
+        self._frames = [frame for frame, _, _ in self._index]
+        keys_end = self._index[0][1] if self._index else footer
+        super().__init__(seed, level, lives, timeout, player, data[start:keys_end])
+        self._data = data
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(data)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as infile:
+            return cls(memoryview(mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)))
+
+    def keyframe(self, frame):
+        """Game restored from the last keyframe at or before frame."""
+        i = bisect.bisect_right(self._frames, frame) - 1
+        _, offset, size = self._index[i]
+        snapshot = pickle.loads(zlib.decompress(self._data[offset : offset + size]))
+        game = Game(self.level, self.lives, self.timeout)
+        game._player_name = self.player
+        game.restore(snapshot)
+        return game
+
+    def seek(self, frame, game=None):
+        """Game after the first `frame` frames, at most `interval` steps away.
+
+        The keyframe before the target is used (not one on it), so the
+        returned game has computed its state for that frame.
+        """
+        if game is None or not game.running or game.total_steps + game._step > frame:
+            game = self.keyframe(max(frame - 1, 0))
+        return super().seek(frame, game)
+
+
+def open_replay(path):
+    """Load either kind of recording."""
+    with open(path, "rb") as infile:
+        magic = infile.read(len(MAGIC))
+    if magic == SEEKABLE_MAGIC:
+        return KeyframeReplay.load(path)
+    return Replay.load(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("replay", help="replay file recorded by the server")
+    parser.add_argument("--frame", help="print the state after this frame", type=int)
+    args = parser.parse_args()
+
+    replay = open_replay(args.replay)
+    print(
+        f"{replay.player}: seed {replay.seed}, level {replay.level}, {len(replay)} frames"
+    )
+    if args.frame is None:
+        game = replay.play()
+        print(f"Score {game.score} at level {game.level}")
+    else:
+        game = replay.seek(args.frame)
+        print(json.dumps(game.state, default=str))
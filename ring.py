@@ -0,0 +1,131 @@
+"""Single-producer, single-consumer message rings in shared memory."""
+import logging
+import struct
+from multiprocessing import resource_tracker, shared_memory
+
+logger = logging.getLogger("Ring")
+logger.setLevel(logging.INFO)
+
+HEADER = struct.Struct("<QII")  # last message written, slots, slot size
+SLOT = struct.Struct("<QBI")  # message number (0 while writing), kind, length
+MORE = 0x80  # kind flag: the message goes on in the next slot
+CONT = 0x40  # kind flag: the slot continues the message of the previous one
+
+
+class Ring:
+    """Fixed-size slots in a SharedMemory block, one writer and one reader.
+
+    Messages are numbered from 1. The writer fills slot n % slots, stamps
+    it with n and then publishes n in the header. The reader copies a slot
+    and checks that the stamp still reads the number it expected, as in a
+    seqlock, so neither side ever waits for the other. A reader that falls
+    more than `slots` messages behind skips to the oldest one still there;
+    slots it missed are counted in `lost`.
+
+    A message larger than a slot is split over consecutive slots (flagged
+    MORE / CONT) and put back together by get(); a message missing a part
+    is dropped. Kinds must be below CONT.
+    """
+
+    def __init__(self, shm, owner=False):
+        self._shm = shm
+        self._owner = owner
+        self._buf = shm.buf
+        self._written, self.slots, self.slot_size = HEADER.unpack_from(self._buf)
+        self._read = 0  # from the first message still in the ring
+        self._parts = []  # of a split message being read
+        self._next = 0  # slot its next part must come from
+        self.lost = 0
+
+    @classmethod
+    def create(cls, slots, slot_size):
+        size = HEADER.size + slots * (SLOT.size + slot_size)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        HEADER.pack_into(shm.buf, 0, 0, slots, slot_size)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name, track=True):
+        """Open a ring created elsewhere.
+
+        Use track=False in processes not started by multiprocessing: their
+        own resource tracker would otherwise unlink the block when they exit.
+        """
+        shm = shared_memory.SharedMemory(name=name)
+        if not track:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def _offset(self, n):
+        return HEADER.size + (n % self.slots) * (SLOT.size + self.slot_size)
+
+    def put(self, kind, payload):
+        size = self.slot_size
+        if len(payload) > size * self.slots:
+            raise ValueError(f"{len(payload)} byte message, the ring holds {size * self.slots}")
+        if len(payload) <= size:
+            self._put(kind, payload)
+            return
+        view = memoryview(payload)
+        last = (len(payload) - 1) // size
+        for i in range(last + 1):
+            flags = (MORE if i < last else 0) | (CONT if i else 0)
+            self._put(kind | flags, view[i * size : (i + 1) * size])
+
+    def _put(self, kind, payload):
+        n = self._written + 1
+        offset = self._offset(n)
+        SLOT.pack_into(self._buf, offset, 0, kind, len(payload))
+        start = offset + SLOT.size
+        self._buf[start : start + len(payload)] = payload
+        SLOT.pack_into(self._buf, offset, n, kind, len(payload))
+        struct.pack_into("<Q", self._buf, 0, n)
+        self._written = n
+
+    def get(self):
+        """Next (kind, payload), or None if there is nothing new."""
+        while (slot := self._get()) is not None:
+            n, kind, payload = slot
+            if kind & CONT and n != self._next:  # start of the message overwritten
+                self.lost += 1 + len(self._parts)
+                self._parts = []
+                continue
+            if not kind & CONT:
+                self.lost += len(self._parts)  # end of the last one overwritten
+                self._parts = []
+            self._parts.append(payload)
+            self._next = n + 1
+            if not kind & MORE:
+                parts, self._parts = self._parts, []
+                return kind & ~(MORE | CONT), parts[0] if len(parts) == 1 else b"".join(parts)
+        return None
+
+    def _get(self):
+        """Next (number, kind, payload) slot, or None."""
+        while True:
+            (written,) = struct.unpack_from("<Q", self._buf)
+            if self._read >= written:
+                return None
+            n = self._read + 1
+            if written - n >= self.slots:
+                self.lost += written - self.slots + 1 - n
+                n = written - self.slots + 1
+
+            offset = self._offset(n)
+            stamp, kind, length = SLOT.unpack_from(self._buf, offset)
+            start = offset + SLOT.size
+            payload = bytes(self._buf[start : start + length])
+            self._read = n
+            if stamp == n and SLOT.unpack_from(self._buf, offset)[0] == n:
+                return n, kind, payload
+            self.lost += 1  # overwritten while we copied it
+
+    def close(self):
+        self._buf = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
@@ -3,19 +3,28 @@ from __future__ import annotations
 import argparse
 import asyncio
 from datetime import datetime
-import json
 import logging
-import os.path
 import random
+import signal
 from collections import namedtuple
+from time import perf_counter_ns
 from typing import Any, Dict, Set
 
-import requests
 import websockets
-from requests import RequestException
 from websockets.legacy.protocol import WebSocketCommonProtocol
 
+from clock import CATCHUP, SKIP
+from codec import JSON, Message, decode, get_codec, wire_size
+from fanout import ViewerFeed
 from game import Game
+from grading import SPOOL_FILE, GradingQueue
+from highscores import Highscores
+from metrics import SIZE_BUCKETS, Registry
+from profiler import FrameProfiler
+from replay import new_recorder, save_replay
+from session import Session
+from shmlink import DELTA, END, FRAME, INFO, LocalLink
+from simproc import ProcessSession
 
 logging.basicConfig(
     level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -26,102 +35,231 @@ wslogger.setLevel(logging.WARN)
 logger = logging.getLogger("Server")
 logger.setLevel(logging.INFO)
 
-Player = namedtuple("Player", ["name", "ws"])
+Player = namedtuple("Player", ["name", "ws", "codec", "link"], defaults=(JSON, None))
 
-HIGHSCORE_FILE = "highscores.json"
-MAX_HIGHSCORES = 10
+PROFILE_FILE = "profile-{}.json"  # per session, see save_profile()
+PROFILE_FOLDED_FILE = "profile-{}.folded"
+MAX_SESSIONS = 8
 
 
 class GameServer:
     """Network Game Server."""
 
-    def __init__(self, level: int, timeout: int, seed: int = 0, grading: str = None, dbg: bool = False):
+    def __init__(self, level: int, timeout: int, seed: int = 0, grading: str = None, dbg: bool = False, delta: bool = False, tick_policy: str = SKIP, profile: bool = False, replays: str = None, keyframes: int = 0, max_sessions: int = MAX_SESSIONS, fast_json: bool = False, grading_spool: str = SPOOL_FILE, processes: bool = False):
         """Initialize Gameserver."""
         self.dbg = dbg
+        self.replays = replays  # directory to record games to
+        self.keyframes = keyframes  # frames between snapshots in seekable replays
+        self.profile = profile
         self.seed = seed
-        self.game = Game()
+        self.delta = delta
+        self.tick_policy = tick_policy
+        self.max_sessions = max_sessions
+        self.processes = processes  # simulate each game in its own process
+        self.fast_json = fast_json  # encode JSON with orjson when installed
         self.players: asyncio.Queue[Player] = asyncio.Queue()
-        self.viewers: Set[WebSocketCommonProtocol] = set()
-        self.current_player: Player | None = None
-        self.grading = grading
+        self.sessions: Dict[WebSocketCommonProtocol, Session] = {}  # by player socket
+        self.viewers: Set[WebSocketCommonProtocol] = set()  # following the featured game
+        self.feeds: Dict[WebSocketCommonProtocol, ViewerFeed] = {}  # of every viewer
+        self._dropped = 0  # frames dropped by viewers that left
+        self._viewer_bytes = 0  # sent to viewers that left
+        self.grading = GradingQueue(grading, grading_spool) if grading else None
         self._level = level  # game level
         self._timeout = timeout  # timeout for game
+        self._tasks: Set[asyncio.Task] = set()
+        self.highscores = Highscores()
 
-        self._highscores = []
-        if os.path.isfile(HIGHSCORE_FILE):
-            with open(HIGHSCORE_FILE, "r") as infile:
-                self._highscores = json.load(infile)
-
-    def save_highscores(self, score: int):
-        """Update highscores, storing to file."""
-        if not self.current_player:
-            raise Exception("Can't save highscores without current player")
-
-        logger.debug("Save highscores")
-        logger.info(
-            "Saving: %s <%s>",
-            self.current_player.name,
-            score,
+        self.metrics = Registry()
+        self.frame_time = self.metrics.histogram(
+            "digdug_frame_seconds", "Time to simulate a frame"
+        )
+        self.tick_lag = self.metrics.histogram(
+            "digdug_tick_lag_seconds", "How late each frame started"
+        )
+        self.encode_time = self.metrics.histogram(
+            "digdug_encode_seconds", "Time to encode a frame for the player and viewers"
+        )
+        self.frame_bytes = self.metrics.histogram(
+            "digdug_frame_bytes", "Size of the frames sent to players", SIZE_BUCKETS
+        )
+        self.player_bytes = self.metrics.counter(
+            "digdug_player_bytes_total", "Bytes sent to players"
+        )
+        self.metrics.gauge(
+            "digdug_viewer_bytes_total",
+            "Bytes sent to viewers",
+            lambda: self._viewer_bytes + sum(feed.bytes for feed in self.feeds.values()),
+            kind="counter",
+        )
+        self.metrics.gauge(
+            "digdug_viewer_frames_dropped_total",
+            "Frames skipped because a viewer fell behind",
+            lambda: self.dropped_frames,
+            kind="counter",
+        )
+        self.metrics.gauge(
+            "digdug_sessions_active", "Games being played", lambda: len(self.sessions)
+        )
+        self.metrics.gauge(
+            "digdug_players_waiting", "Players queued for a session", self.players.qsize
+        )
+        self.metrics.gauge(
+            "digdug_viewers_connected", "Viewers connected", lambda: len(self.feeds)
         )
 
-        self._highscores.append((self.current_player.name, score))
-        self._highscores = sorted(self._highscores, key=lambda s: s[1], reverse=True)[
-            :MAX_HIGHSCORES
-        ]
-
-        with open(HIGHSCORE_FILE, "w") as outfile:
-            json.dump(self._highscores, outfile)
-
-    async def send_info(self, game_info: Dict[str, Any], highscores: bool = False):
+    @property
+    def featured(self) -> Session | None:
+        """The oldest running session, shown to viewers that did not pick one."""
+        return next(iter(self.sessions.values()), None)
+
+    def audience(self, session: Session):
+        """Viewers that receive the frames of session."""
+        if session is self.featured:
+            return session.viewers | self.viewers
+        return session.viewers
+
+    @property
+    def dropped_frames(self) -> int:
+        """Frames skipped so far because a viewer fell behind."""
+        return self._dropped + sum(feed.dropped for feed in self.feeds.values())
+
+    def add_viewer(self, websocket: WebSocketCommonProtocol, codec=JSON) -> ViewerFeed:
+        if websocket in self.feeds:
+            return self.feeds[websocket]
+        feed = ViewerFeed(
+            websocket, on_close=lambda feed: self.remove_viewer(feed.ws), codec=codec
+        )
+        self.feeds[websocket] = feed
+        return feed
+
+    def remove_viewer(self, websocket: WebSocketCommonProtocol):
+        if feed := self.feeds.pop(websocket, None):
+            feed.close()
+            self._dropped += feed.dropped
+            self._viewer_bytes += feed.bytes
+        self.viewers.discard(websocket)
+        for session in self.sessions.values():
+            session.viewers.discard(websocket)
+
+    def toggle_profiler(self):
+        """Turn frame profiling on or off for every running session."""
+        self.profile = not self.profile
+        for session in self.sessions.values():
+            session.game.profiler.enabled = self.profile
+        logger.info("Frame profiler %s", "on" if self.profile else "off")
+
+    async def save_profile(self, session: Session):
+        """Dump frame phase timings, as JSON and as folded stacks for flamegraph.pl.
+
+        Files are named after the session and player, and written from a
+        worker thread so the other sessions keep their ticks.
+        """
+        name = "".join(c if c.isalnum() else "_" for c in session.player.name)
+        stem = f"{session.id}-{name}"
+        logger.info("Saving frame profile to %s", PROFILE_FILE.format(stem))
+        await asyncio.to_thread(self._write_profile, session.game.profiler, stem)
+
+    @staticmethod
+    def _write_profile(profiler: FrameProfiler, stem: str):
+        try:
+            with open(PROFILE_FILE.format(stem), "w") as outfile:
+                outfile.write(profiler.to_json())
+            with open(PROFILE_FOLDED_FILE.format(stem), "w") as outfile:
+                outfile.write(profiler.folded())
+        except OSError as err:
+            logger.error("Could not save frame profile: %s", err)
+
+    def broadcast(self, session: Session, message: Message, droppable: bool = True):
+        """Queue a message for the viewers of session, without waiting for them.
+
+        Frames are droppable: a viewer that falls behind skips to the latest.
+        """
+        for viewer in self.audience(session):
+            feed = self.feeds[viewer]
+            feed.put(message.encode(feed.codec), droppable)
+
+    async def send_info(self, session: Session, game_info: Dict[str, Any], highscores: bool = False):
         """Send game info to viewer and player."""
 
         if highscores:
-            game_info["highscores"] = self._highscores
-            game_info["player"] = self.current_player.name
-
-        for viewer in self.viewers:
-            try:
-                await viewer.send(json.dumps(game_info))
-            except Exception:
-                self.viewers.remove(viewer)
-                break
-        if self.current_player:
-            await self.current_player.ws.send(json.dumps(game_info))
+            game_info["highscores"] = self.highscores.top()
+            game_info["player"] = session.player.name
+
+        message = Message(game_info)
+        self.broadcast(session, message, droppable=False)
+        await self.send_player(
+            session.player, message.encode(session.player.codec), END if highscores else INFO
+        )
+
+    async def send_player(self, player: Player, data, kind=FRAME):
+        """Send to the player, through shared memory if it joined with it."""
+        if player.link:
+            player.link.send(kind, data)
+        else:
+            await player.ws.send(data)
 
     async def incomming_handler(self, websocket: WebSocketCommonProtocol, path: str):
         """Process new clients arriving at the server."""
+        joined = False  # sessions are keyed by socket: one game per connection
         try:
             async for message in websocket:
-                data = json.loads(message)
+                data = decode(message)
                 if "cmd" not in data:
                     continue
                 if data["cmd"] == "join":
+                    codec = get_codec(
+                        data.get("codec"), self.fast_json, data.get("map") == "packed"
+                    )
                     if path == "/player":
-                        logger.info("<%s> has joined", data["name"])
-                        await self.players.put(Player(data["name"], websocket))
+                        if joined:
+                            logger.warning("<%s> joined twice, ignored", data["name"])
+                            continue
+                        joined = True
+                        link = None
+                        if data.get("transport") == "shm":
+                            # same machine: frames and keys go through shared memory
+                            link = LocalLink.create()
+                            await websocket.send(JSON.dumps({"shm": link.names}))
+                        logger.info(
+                            "<%s> has joined (%s%s)",
+                            data["name"],
+                            codec.name,
+                            ", shared memory" if link else "",
+                        )
+                        await self.players.put(Player(data["name"], websocket, codec, link))
 
                     if path == "/viewer":
+                        # watch a given player's game, else follow the featured one
+                        session = next(
+                            (
+                                s
+                                for s in self.sessions.values()
+                                if s.player.name == data.get("player")
+                            ),
+                            None,
+                        )
                         logger.info("Viewer connected")
-                        self.viewers.add(websocket)
-                        if self.game.running:
-                            game_info = self.game.info()
-                            await websocket.send(json.dumps(game_info))
-
-                if (
-                    data["cmd"] == "key"
-                    and self.current_player
-                    and self.current_player.ws == websocket
-                ):
-                    logger.debug((self.current_player.name, data))
+                        feed = self.add_viewer(websocket, codec)
+                        if session:
+                            session.viewers.add(websocket)
+                        else:
+                            self.viewers.add(websocket)
+                            session = self.featured
+                        if session and session.game.running:
+                            game_info = session.game.info()
+                            feed.put(Message(game_info).encode(codec), droppable=False)
+
+                if data["cmd"] == "key" and (session := self.sessions.get(websocket)):
+                    logger.debug((session.player.name, data))
                     if len(data["key"]) > 0:
-                        self.game.keypress(data["key"][0])
+                        session.keypress(data["key"][0], data.get("frame"))
                     else:
-                        self.game.keypress("")
+                        session.keypress("", data.get("frame"))
 
         except websockets.exceptions.ConnectionClosed as closed_reason:
             logger.info("Client disconnected: %s", closed_reason)
-            if websocket in self.viewers:
-                self.viewers.remove(websocket)
+        finally:
+            self.remove_viewer(websocket)
 
     def debug_map(self, mapa, digdug, enemies):
         from PIL import Image
@@ -143,74 +281,162 @@ class GameServer:
         img.save("lives_{_digdug.lives}.png")
         img.show()
 
+    def new_game(self, session: Session) -> Game:
+        """Game for a session, with its profiler and replay recorder attached."""
+        game = Game(delta=self.delta, tick_policy=self.tick_policy)
+        game.profiler = FrameProfiler(enabled=self.profile)
+        if self.replays:
+            game.recorder = new_recorder(game, session.seed, session.player.name, self.keyframes)
+        return game
+
     async def mainloop(self):
-        """Run the game."""
+        """Start a session for each player that joins, up to max_sessions at once."""
+        if self.grading:
+            self._tasks.add(asyncio.create_task(self.grading.run()))
+
+        slots = asyncio.Semaphore(self.max_sessions)
         while True:
+            await slots.acquire()
             logger.info("Waiting for player")
-            self.current_player = await self.players.get()
+            player = await self.players.get()
 
-            if self.current_player.ws.closed:
-                logger.error("<%s> disconnect while waiting", self.current_player.name)
+            if player.ws.closed:
+                logger.error("<%s> disconnect while waiting", player.name)
+                if player.link:
+                    player.link.close()
+                slots.release()
                 continue
 
-            try:
-                logger.info("Starting game for <%s>", self.current_player.name)
-                if self.seed > 0:
-                    random.seed(self.seed)
-
-                self.game = Game()
-                self.game.start(self.current_player.name)
-
-                if self.grading:
-                    game_record = {}
-                    game_record["player"] = self.current_player.name
-
-                while self.game.running:
-                    if self.game._step == 0:  # Starting a level ? Let's send the info
-                        game_info = self.game.info()
-                        await self.send_info(game_info)
-
-                    if state := await self.game.next_frame():
-                        state["player"] = self.current_player.name
-                        state["ts"] = datetime.utcnow().astimezone().timestamp()
-                        state = json.dumps(state)
-
-                        await self.current_player.ws.send(state)
-
-                        for viewer in self.viewers:
-                            try:
-                                await viewer.send(state)
-                            except Exception:
-                                self.viewers.remove(viewer)
-                                break
-
-                        if self.dbg and self.game.respawn:
-                            self.debug_map(self.game.map, self.game._digdug, self.game._enemies)
-
-                self.save_highscores(self.game.score)
-
-                game_info = self.game.info()
-                game_info["player"] = self.current_player.name
-
-                await self.send_info(game_info, highscores=True)
-                await self.current_player.ws.close()
-                self.current_player = None
-
-            except websockets.exceptions.ConnectionClosed:
-                self.current_player = None
-            finally:
-                try:
-                    if self.grading:
-                        game_record["score"] = self.game.score
-                        game_record["level"] = self.game.level
-                        requests.post(self.grading, json=game_record, timeout=2)
-                except RequestException as err:
-                    logger.error(err)
-                    logger.warning("Could not save score to server")
-
-                if self.current_player:
-                    logger.info("Disconnecting <%s>", self.current_player.name)
-                    await self.current_player.ws.close()
+            task = asyncio.create_task(self.run_session(player))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            task.add_done_callback(lambda _: slots.release())
+
+    async def run_session(self, player: Player):
+        """Play one game for player.
+
+        Each session is its own task on its own frame clock. Every frame
+        awaits the clock, even when late, so a session whose frames overrun
+        only falls behind itself and the other sessions still get their ticks.
+        """
+        # a given --seed is played by everyone; replays need a known seed anyway
+        seed = self.seed if self.seed > 0 else random.randrange(1, 2**32)
+        session = ProcessSession(player, seed) if self.processes else Session(player, seed)
+        connected = True
+        try:
+            logger.info("Starting game for <%s>", player.name)
+            if self.processes:
+                options = {
+                    "delta": self.delta,
+                    "tick_policy": self.tick_policy,
+                    "replays": self.replays,
+                    "keyframes": self.keyframes,
+                    "agent_keys": player.link and player.link.names["keys"],
+                }
+                await session.launch(options, FrameProfiler(enabled=self.profile))
+            else:
+                session.start(lambda: self.new_game(session))
+            # only now has it level info for viewers, and a game to profile
+            self.sessions[player.ws] = session
+            game = session.game
+            featured = False
+
+            while game.running:
+                if player.link and player.ws.closed:
+                    # nothing goes over its socket, so no send fails to tell us
+                    logger.info("<%s> left", player.name)
+                    connected = False
+                    return
+                if game._step == 0:  # Starting a level ? Let's send the info
+                    game_info = game.info()
+                    await self.send_info(session, game_info)
+                elif not featured and self.featured is session and self.viewers:
+                    # previous featured game ended, its followers need our map
+                    self.broadcast(session, Message(game.info()), droppable=False)
+                featured = self.featured is session
+
+                if state := await session.next_frame():
+                    state["player"] = player.name
+                    state["ts"] = datetime.utcnow().astimezone().timestamp()
+                    state["frame"] = session.frames  # echoed back with the key
+                    self.frame_time.observe(session.step_ns / 1e9)
+                    self.tick_lag.observe(game.clock.lag)
+
+                    # encoded once per codec, before the state is reused
+                    start = perf_counter_ns()
+                    message = Message(state)
+                    data = message.encode(player.codec)
+                    if not self.delta:
+                        self.broadcast(session, message)
+                    elif self.audience(session) and game.state:
+                        # viewer feeds drop frames, which breaks a delta chain
+                        view = dict(game.state, ts=state["ts"], frame=state["frame"])
+                        self.broadcast(session, Message(view))
+                    self.encode_time.observe((perf_counter_ns() - start) / 1e9)
+                    game.profiler.mark("encode")
+
+                    session.latency.sent(session.frames)
+                    await self.send_player(player, data, DELTA if self.delta else FRAME)
+                    size = wire_size(data)
+                    self.frame_bytes.observe(size)
+                    self.player_bytes.inc(size)
+                    game.profiler.mark("send")
+
+                    if self.dbg and game.respawn:
+                        self.debug_map(game.map, game._digdug, game._enemies)
+
+            latency = session.latency
+            latency.close()
+            reply = latency.timings.to_dict().get("reply")
+            logger.info(
+                "Keys: %s, %s late, %s overwritten, %s unlabelled; reply p50 %s us, p99 %s us",
+                latency.keys,
+                latency.late,
+                latency.overwritten,
+                latency.unlabelled,
+                reply and round(reply["p50_us"]),
+                reply and round(reply["p99_us"]),
+            )
+            clock = game.clock
+            logger.info(
+                "Ticks: %s late, %s skipped, max lag %.1f ms; %s viewer frames dropped",
+                clock.late,
+                clock.skipped,
+                clock.max_lag * 1000,
+                self.dropped_frames,
+            )
+            self.highscores.add(player.name, game.score)
+            if game.profiler.enabled:
+                await self.save_profile(session)
+
+            game_info = game.info()
+            game_info["player"] = player.name
+            game_info["latency"] = latency.to_dict()
+
+            await self.send_info(session, game_info, highscores=True)
+            await player.ws.close()
+            connected = False
+
+        except websockets.exceptions.ConnectionClosed:
+            connected = False
+        finally:
+            self.sessions.pop(player.ws, None)  # not there if the launch failed
+            await session.close()
+            if player.link:
+                player.link.close()
+            game = session.game
+            if self.grading and game:
+                self.grading.submit(
+                    {"player": player.name, "score": game.score, "level": game.level}
+                )
+
+            if game and game.recorder:
+                recorder, game.recorder = game.recorder, None
+                await asyncio.to_thread(save_replay, self.replays, recorder)
+
+            if connected:
+                logger.info("Disconnecting <%s>", player.name)
+                await player.ws.close()
 
 
 if __name__ == "__main__":
@@ -219,6 +445,54 @@ if __name__ == "__main__":
     parser.add_argument("--port", help="TCP port", type=int, default=8000)
     parser.add_argument("--seed", help="Seed number", type=int, default=0)
     parser.add_argument("--debug", help="Open Bitmap with map on gameover", action='store_true')
+    parser.add_argument("--delta", help="Send frames as deltas (see delta.py)", action='store_true')
+    parser.add_argument(
+        "--tick-policy",
+        help="What to do with late ticks: drop them or run them back to back",
+        choices=[SKIP, CATCHUP],
+        default=SKIP,
+    )
+    parser.add_argument(
+        "--replays", help="directory to record games to (off by default)", default=""
+    )
+    parser.add_argument(
+        "--keyframes",
+        help="make replays seekable with a snapshot every N frames (0: keys only)",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--profile",
+        help="Record per-phase frame timings (toggle with SIGUSR1)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--fast-json",
+        help="encode JSON with orjson, if installed",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        help="serve Prometheus metrics at http://bind:port/metrics (0: off)",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--grading-spool",
+        help="file keeping scores until the grading server has them",
+        default=SPOOL_FILE,
+    )
+    parser.add_argument(
+        "--processes",
+        help="simulate every game in its own process, apart from the network I/O",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--sessions",
+        help="games to run at once, further players wait their turn",
+        type=int,
+        default=MAX_SESSIONS,
+    )
     parser.add_argument(
         "--grading-server",
         help="url of grading server",
@@ -228,13 +502,24 @@ if __name__ == "__main__":
 
     async def main():
         """Start server tasks."""
-        g = GameServer(0, -1, args.seed, args.grading_server, args.debug)
+        g = GameServer(0, -1, args.seed, args.grading_server, args.debug, args.delta, args.tick_policy, args.profile, args.replays, args.keyframes, args.sessions, args.fast_json, args.grading_spool, args.processes)
+        if hasattr(signal, "SIGUSR1"):
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGUSR1, g.toggle_profiler
+            )
 
         game_loop_task = asyncio.ensure_future(g.mainloop())
+        if args.metrics_port:
+            await g.metrics.serve(args.bind, args.metrics_port)
 
         logger.info("Listenning @ %s:%s", args.bind, args.port)
         websocket_server = websockets.serve(g.incomming_handler, args.bind, args.port)
 
-        await asyncio.gather(websocket_server, game_loop_task)
+        try:
+            await asyncio.gather(websocket_server, game_loop_task)
+        finally:
+            g.highscores.close()  # scores still waiting for their flush
+            if g.grading:
+                g.grading.close()
 
     asyncio.run(main())
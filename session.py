@@ -0,0 +1,86 @@
+"""A player's game on the server, with its viewers and its own random state."""
+import itertools
+import logging
+import random
+from time import perf_counter_ns
+
+from latency import InputLatency
+
+logger = logging.getLogger("Session")
+logger.setLevel(logging.INFO)
+
+
+class Session:
+    """One player's game and the viewers that asked to watch it.
+
+    The server runs sessions side by side on one event loop. Every session
+    keeps its own copy of the `random` module state (like BatchGame lanes)
+    and swaps it in around each call into its game, so a game started on
+    seed s plays the same whatever else the server runs.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, player, seed):
+        self.id = next(Session._ids)
+        self.player = player
+        self.seed = seed
+        self.viewers = set()
+        self.game = None
+        self.frames = 0  # states computed, the frame number clients echo
+        self.latency = InputLatency()
+        self.step_ns = 0  # time the last step took
+        self._rng = None
+
+    def _run(self, fn, *args):
+        """Call fn with this session's random state swapped in."""
+        outer = random.getstate()
+        random.setstate(self._rng)
+        try:
+            return fn(*args)
+        finally:
+            self._rng = random.getstate()
+            random.setstate(outer)
+
+    def start(self, new_game):
+        """Create the game with new_game() on the session seed and start it."""
+        outer = random.getstate()
+        random.seed(self.seed)
+        try:
+            self.game = new_game()
+            self.game.start(self.player.name)
+        finally:
+            self._rng = random.getstate()
+            random.setstate(outer)
+        logger.info("Session %s: <%s> on seed %s", self.id, self.player.name, self.seed)
+
+    def keypress(self, key, frame=None):
+        """Key from the player, answering the given frame number."""
+        self.latency.received(key, frame if isinstance(frame, int) else None)
+        self.game.keypress(key)
+
+    def step(self, key=None):
+        ran = self.game.running
+        start = perf_counter_ns()
+        state = self._run(self.game.step, key)
+        self.step_ns = perf_counter_ns() - start
+        if state is not None:
+            self.frames += 1
+        if ran:  # a level change steps without a state, but uses the key
+            self.latency.applied(self.frames)
+        return state
+
+    async def next_frame(self):
+        """Game.next_frame() for this session: wait for the tick, then step."""
+        profiler = self.game.profiler
+        profiler.begin()
+        await self.game.clock.tick()
+        profiler.mark("sleep")
+        link = getattr(self.player, "link", None)
+        if link:  # keys written to shared memory since the last step
+            for key, frame in link.keys():
+                self.keypress(key, frame)
+        return self.step()
+
+    async def close(self):
+        """Release what the session holds once its game is over."""
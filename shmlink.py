@@ -0,0 +1,125 @@
+"""Shared-memory transport between the server and an agent on the same machine.
+
+An agent joins over the websocket as usual, adding "transport": "shm":
+
+    {"cmd": "join", "name": "student", "transport": "shm"}
+
+The server answers on the websocket with the names of two Rings
+({"shm": {"frames": ..., "keys": ...}}) and from then on writes level
+info, frames and the final result (with highscores) into the frames ring,
+encoded with the codec the agent asked for. The agent writes its keys,
+with the frame number they answer, into the keys ring, which the game
+reads right before each step. No socket or JSON wrapping is involved per
+frame; the websocket only stays open to tell when either side leaves.
+"""
+import asyncio
+import logging
+import struct
+import time
+
+from codec import get_codec
+from ring import Ring
+
+logger = logging.getLogger("LocalLink")
+logger.setLevel(logging.INFO)
+
+INFO, FRAME, END, DELTA = range(4)  # DELTA: a delta-encoded frame
+FRAME_SLOTS = 64
+SLOT_SIZE = 16 * 1024
+KEY_SLOTS = 16
+KEY = struct.Struct("<I")  # frame answered, followed by the key (0 or 1 byte)
+NO_FRAME = 0xFFFFFFFF
+POLL = 0.00005  # seconds between the first looks at the ring in wait()
+MAX_POLL = 0.001  # ... backing off to this while no frame comes
+
+
+def pack_key(key, frame=None):
+    return KEY.pack(NO_FRAME if frame is None else frame) + key.encode()[:1]
+
+
+def unpack_key(payload):
+    (frame,) = KEY.unpack_from(payload)
+    return payload[KEY.size :].decode(), None if frame == NO_FRAME else frame
+
+
+class LocalLink:
+    """Both ends of the shared-memory transport.
+
+    The server creates the link and uses send() and keys(); the agent
+    attaches to it and uses recv() or wait(), and send_key().
+    """
+
+    def __init__(self, frames, keys, codec="json"):
+        self._frames = frames
+        self._keys = keys
+        self._codec = get_codec(codec)
+        self.closed = False  # the agent got the final result
+
+    @classmethod
+    def create(cls):
+        return cls(Ring.create(FRAME_SLOTS, SLOT_SIZE), Ring.create(KEY_SLOTS, KEY.size + 1))
+
+    @classmethod
+    def attach(cls, frames, keys, codec="json", track=False):
+        return cls(Ring.attach(frames, track), Ring.attach(keys, track), codec)
+
+    @property
+    def names(self):
+        return {"frames": self._frames.name, "keys": self._keys.name}
+
+    # server side
+
+    def send(self, kind, data):
+        """Publish a message already encoded with the agent's codec."""
+        self._frames.put(kind, data.encode() if isinstance(data, str) else data)
+
+    def keys(self):
+        """(key, frame) pairs the agent wrote since the last call."""
+        while (message := self._keys.get()) is not None:
+            yield unpack_key(message[1])
+
+    # agent side
+
+    def recv(self):
+        """Next message, or None if there is none yet.
+
+        Older frames are skipped when a newer one is waiting (the latest
+        frame wins). Level info, the final result and delta-encoded frames
+        (DELTA, which depend on every previous one) never are.
+        """
+        frame = None
+        while (message := self._frames.get()) is not None:
+            kind, payload = message
+            if kind == FRAME:
+                frame = payload
+                continue
+            if kind == END:
+                self.closed = True
+            return self._codec.loads(payload)  # any frame before it is stale
+        if frame is not None:
+            return self._codec.loads(frame)
+        return None
+
+    async def wait(self, timeout):
+        """recv(), polling until a message arrives or timeout seconds pass.
+
+        Polls with asyncio.sleep() so the agent's websocket still answers
+        pings while it waits. The pause between looks doubles from POLL to
+        MAX_POLL, so a frame is picked up within a millisecond without
+        spinning through the 25 ms between frames.
+        """
+        deadline = time.monotonic() + timeout
+        poll = POLL
+        while (message := self.recv()) is None:
+            if time.monotonic() > deadline:
+                return None
+            await asyncio.sleep(poll)
+            poll = min(poll * 2, MAX_POLL)
+        return message
+
+    def send_key(self, key, frame=None):
+        self._keys.put(0, pack_key(key, frame))
+
+    def close(self):
+        self._frames.close()
+        self._keys.close()
@@ -0,0 +1,255 @@
+"""Run a session's game in its own process, apart from the network front-end.
+
+The simulation process paces and steps the game and publishes every
+message (level info, frames, the final result) into a shared-memory Ring,
+then pokes a pipe so the front-end wakes up. The front-end reads the ring
+from its event loop, encodes and sends, and writes the player's keys
+into a second ring that the simulation drains before each step. Neither
+side takes a lock, so network bursts no longer delay the ticks.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import pickle
+import random
+import time
+from time import perf_counter_ns
+
+from codec import Static
+from delta import DeltaDecoder
+from game import Game
+from profiler import FrameProfiler
+from replay import new_recorder, save_replay
+from ring import Ring
+from session import Session
+from shmlink import unpack_key
+
+logger = logging.getLogger("Simulation")
+logger.setLevel(logging.INFO)
+
+INFO, FRAME, END = range(3)  # simulation -> front-end
+KEY, STOP = range(2)  # front-end -> simulation
+FRAME_SLOTS = 128  # 3 s of frames at 40 fps
+SLOT_SIZE = 16 * 1024  # states of high levels span several slots
+KEY_SLOTS = 16
+
+_context = multiprocessing.get_context("spawn")
+
+
+def simulate(player, seed, options, frames_name, keys_name, wakeup):
+    """Simulation process: play one game, publishing into the frames ring."""
+    frames = Ring.attach(frames_name)
+    keys = Ring.attach(keys_name)
+    # an agent on a shared-memory link writes its keys here directly
+    agent_keys = options.get("agent_keys") and Ring.attach(options["agent_keys"])
+    fd = wakeup.fileno()
+    os.set_blocking(fd, False)
+
+    def publish(kind, data):
+        frames.put(kind, pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+        try:
+            os.write(fd, b"\0")
+        except BlockingIOError:
+            pass  # front-end is behind, it will read the ring anyway
+
+    random.seed(seed)
+    game = Game(delta=options["delta"], tick_policy=options["tick_policy"])
+    if options["replays"]:
+        game.recorder = new_recorder(game, seed, player, options["keyframes"])
+    game.start(player)
+    clock = game.clock
+    try:
+        while game.running:
+            if game._step == 0:
+                publish(INFO, game.info())
+            time.sleep(clock.wait())
+
+            while message := keys.get():
+                kind, key = message
+                if kind == STOP:
+                    game.stop()
+                    break
+                game.keypress(key.decode())
+            if agent_keys:
+                while message := agent_keys.get():
+                    game.keypress(unpack_key(message[1])[0])
+
+            start = perf_counter_ns()
+            if state := game.step():
+                meta = {
+                    "step": game._step,
+                    "score": game._score,  # the score property adds the end-of-game bonus
+                    "level": game.level,
+                    "lag": clock.lag,
+                    "step_ns": perf_counter_ns() - start,
+                }
+                publish(FRAME, (state, meta))
+
+        publish(
+            END,
+            {
+                "info": game.info(),
+                "score": game.score,
+                "level": game.level,
+                "late": clock.late,
+                "skipped": clock.skipped,
+                "max_lag": clock.max_lag,
+            },
+        )
+    finally:
+        if game.recorder:
+            save_replay(options["replays"], game.recorder)
+        frames.close()
+        keys.close()
+        if agent_keys:
+            agent_keys.close()
+        wakeup.close()
+
+
+class RemoteClock:
+    """What the front-end knows of the simulation's FrameClock."""
+
+    lag = 0.0
+    max_lag = 0.0
+    late = 0
+    skipped = 0
+
+
+class RemoteGame:
+    """Front-end stand-in for a game running in a simulation process."""
+
+    recorder = None  # the simulation saves its own replay
+    respawn = False
+
+    def __init__(self, profiler, delta=False):
+        self.profiler = profiler
+        self.state = None  # full state of the last frame, as Game.state
+        self._delta = DeltaDecoder() if delta else None
+        self.clock = RemoteClock()
+        self.running = True
+        self._step = -1  # no level info yet
+        self._info = None
+        self.score = 0
+        self.level = 0
+
+    def info(self):
+        return dict(self._info)
+
+
+class ProcessSession(Session):
+    """Session whose game runs in a simulation process, see simulate()."""
+
+    def __init__(self, player, seed):
+        super().__init__(player, seed)
+        self._process = None
+        self._frames = None
+        self._keys = None
+        self._wakeup = None
+        self._ready = asyncio.Event()
+        self._eof = False
+        self._rocks = None  # last Static rocks list, to keep its encoding
+
+    async def launch(self, options, profiler=None):
+        """Start the simulation process and wait for its first level info."""
+        self._frames = Ring.create(FRAME_SLOTS, SLOT_SIZE)
+        self._keys = Ring.create(KEY_SLOTS, 1)
+        self._wakeup, writer = _context.Pipe(duplex=False)
+        self._process = _context.Process(
+            target=simulate,
+            args=(self.player.name, self.seed, options, self._frames.name, self._keys.name, writer),
+            name=f"simulation-{self.id}",
+            daemon=True,
+        )
+        self._process.start()
+        writer.close()
+        os.set_blocking(self._wakeup.fileno(), False)
+        asyncio.get_running_loop().add_reader(self._wakeup.fileno(), self._on_wakeup)
+
+        self.game = RemoteGame(profiler or FrameProfiler(), options["delta"])
+        logger.info(
+            "Session %s: <%s> on seed %s, pid %s",
+            self.id,
+            self.player.name,
+            self.seed,
+            self._process.pid,
+        )
+        while self.game._step < 0 and self.game.running:
+            await self.next_frame()
+        if self.game._step < 0:
+            raise RuntimeError(f"Simulation process of session {self.id} failed")
+
+    def _on_wakeup(self):
+        try:
+            if not os.read(self._wakeup.fileno(), 4096):
+                self._eof = True  # simulation exited
+                asyncio.get_running_loop().remove_reader(self._wakeup.fileno())
+        except BlockingIOError:
+            pass
+        self._ready.set()
+
+    def keypress(self, key, frame=None):
+        self.latency.received(key, frame if isinstance(frame, int) else None)
+        self._keys.put(KEY, key.encode()[:1])
+
+    async def next_frame(self):
+        """Next frame from the simulation; None for level info and the end."""
+        game = self.game
+        game.profiler.begin()
+        while (message := self._frames.get()) is None:
+            if self._eof:
+                logger.error("Session %s: simulation ended without a result", self.id)
+                game.running = False
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+        game.profiler.mark("sleep")
+
+        kind, payload = message
+        data = pickle.loads(payload)
+        if kind == INFO:
+            game._info = data
+            game._step = 0
+            self.latency.applied(self.frames)  # the level change step used the key
+        elif kind == FRAME:
+            state, meta = data
+            rocks = state.get("rocks")
+            if type(rocks) is Static:  # unpickled anew each frame
+                if rocks == self._rocks:
+                    state["rocks"] = self._rocks
+                else:
+                    self._rocks = rocks
+            game._step = meta["step"]
+            game.score = meta["score"]
+            game.level = meta["level"]
+            game.clock.lag = meta["lag"]
+            self.step_ns = meta["step_ns"]
+            game.state = game._delta.apply(dict(state)) if game._delta else state
+            self.frames += 1
+            self.latency.applied(self.frames)
+            return state
+        else:
+            game._info = data["info"]
+            game.score = data["score"]
+            game.level = data["level"]
+            clock = game.clock
+            clock.late, clock.skipped, clock.max_lag = data["late"], data["skipped"], data["max_lag"]
+            game.running = False
+        return None
+
+    async def close(self):
+        process, self._process = self._process, None
+        if process is None:
+            return
+        if process.is_alive():
+            self._keys.put(STOP, b"")
+            await asyncio.to_thread(process.join, 1)
+            if process.is_alive():
+                process.terminate()
+        if not self._eof:
+            asyncio.get_running_loop().remove_reader(self._wakeup.fileno())
+        self._wakeup.close()
+        if self._frames.lost:
+            logger.warning("Session %s: %s frames lost", self.id, self._frames.lost)
+        self._frames.close()
+        self._keys.close()
@@ -13,6 +13,10 @@ import websockets
 import math
 
 import game
+from codec import decode
+from delta import DeltaDecoder
+from mapa import unpack_tiles
+from shmlink import LocalLink
 from tree_search import *
 from consts import *
 from typing import Union, Callable
@@ -478,7 +482,7 @@ class Agent:
             return self.dig_map(chosen_dir, fallback)
 
         else:
-            self.map: list[list[int]] = state["map"]
+            self.map: list[list[int]] = unpack_tiles(state["map"], state["size"])
             self.map_size: list[int, int] = state["size"]
             self.enemies_stuck = set()
             self.steps = 0
@@ -486,20 +490,60 @@ class Agent:
         return ""
 
 
-async def agent_loop(server_address="localhost:8000", agent_name="student"):
+async def agent_loop(
+    server_address="localhost:8000",
+    agent_name="student",
+    codec=os.environ.get("CODEC", "json"),  # or "msgpack"
+    transport=os.environ.get("TRANSPORT", "ws"),  # or "shm" on the server's machine
+):
     agent = Agent()
+    decoder = DeltaDecoder()
     async with websockets.connect(f"ws://{server_address}/player") as websocket:
         # Receive information about static game properties
-        await websocket.send(json.dumps({"cmd": "join", "name": agent_name}))
+        await websocket.send(
+            json.dumps(
+                {
+                    "cmd": "join",
+                    "name": agent_name,
+                    "codec": codec,
+                    "map": "packed",
+                    "transport": transport,
+                }
+            )
+        )
+        link = None
+        if transport == "shm":
+            link = LocalLink.attach(**decode(await websocket.recv())["shm"], codec=codec)
 
         starttime = time.monotonic()
         while True:
             try:
                 # Receive game update.
-                state: dict = json.loads(await websocket.recv())
+                if link:
+                    if link.closed:
+                        print("Game over")
+                        link.close()
+                        return
+                    message = await link.wait(timeout=1)
+                    if message is None:
+                        if websocket.closed:  # the server left without a result
+                            print("Server has disconnected us")
+                            link.close()
+                            return
+                        continue
+                    state: dict = decoder.apply(message)
+                else:
+                    state: dict = decoder.apply(decode(await websocket.recv()))
+                if state is None:  # lost track of the deltas, wait for a keyframe
+                    continue
 
                 key: str = agent.get_key(state)
-                await websocket.send(json.dumps({"cmd": "key", "key": key}))
+                if link:
+                    link.send_key(key, state.get("frame"))
+                else:
+                    await websocket.send(
+                        json.dumps({"cmd": "key", "key": key, "frame": state.get("frame")})
+                    )
 
                 # Time sync
                 time.sleep(
@@ -0,0 +1,28 @@
+import random
+
+from batch import BatchGame
+from game import Game
+
+
+def positions(state):
+    return state["digdug"], [e["pos"] for e in state["enemies"]], state["score"]
+
+
+def test_lanes_replay_their_seed():
+    batch = BatchGame(3, seed=10, timeout=50)
+    infos = batch.reset()
+    assert [i["level"] for i in infos] == [1, 1, 1]
+
+    random.seed(11)
+    solo = Game(timeout=50)
+    solo.start("batch")
+
+    for _ in range(49):
+        states, rewards, dones = batch.step(["d", "s", "A"])
+        assert positions(states[1]) == positions(solo.step("s"))
+        assert dones == [False, False, False]
+
+    states, rewards, dones = batch.step(["d", "s", "A"])
+    assert dones == [True, True, True]  # timeout
+    assert batch.seeds == [13, 14, 15]
+    assert batch.games[0].running
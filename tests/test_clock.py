@@ -0,0 +1,34 @@
+import pytest
+
+from clock import CATCHUP, SKIP, FrameClock
+
+
+@pytest.fixture
+def now():
+    return [100.0]
+
+
+def test_absorbs_frame_time(now):
+    c = FrameClock(10, now=lambda: now[0])
+    assert c.wait() == pytest.approx(0.1)
+    now[0] += 0.1 + 0.03  # slept, then spent 30 ms on the frame
+    assert c.wait() == pytest.approx(0.07)
+    assert c.late == 0
+
+
+def test_skip_stays_on_grid(now):
+    c = FrameClock(10, SKIP, now=lambda: now[0])
+    c.wait()
+    now[0] += 0.35  # a 250 ms hiccup
+    assert c.wait() == 0.0
+    assert c.skipped == 1 and c.lag == pytest.approx(0.15)
+    assert c.wait() == pytest.approx(0.05)
+
+
+def test_catchup_runs_missed_frames(now):
+    c = FrameClock(10, CATCHUP, now=lambda: now[0])
+    c.wait()
+    now[0] += 0.35
+    assert [c.wait() for _ in range(2)] == [0.0, 0.0]
+    assert c.wait() == pytest.approx(0.05)
+    assert c.skipped == 0
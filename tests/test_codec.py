@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+import codec
+from codec import JSON, Message, Static, decode, get_codec
+from mapa import unpack_tiles
+
+
+class CountingCodec(codec.JsonCodec):
+    calls = 0
+
+    def dumps(self, data):
+        self.calls += 1
+        return super().dumps(data)
+
+
+def test_message_is_encoded_once_per_codec():
+    counting = CountingCodec()
+    message = Message({"step": 1, "digdug": (1, 1)})
+    assert message.encode(counting) is message.encode(counting)
+    assert counting.calls == 1
+    assert decode(message.encode(JSON)) == {"step": 1, "digdug": [1, 1]}
+
+
+def test_fast_json_is_plain_json():
+    data = {"map": [[0, 1], [1, 0]], "ts": 1.5, "player": "Zé"}
+    fast = get_codec("json", fast_json=True)
+    assert isinstance(fast.dumps(data), str)
+    assert json.loads(fast.dumps(data)) == data
+    message = Message(data)
+    message.encode(fast)
+    assert message.encode(JSON) == json.dumps(data)  # not orjson's cached text
+
+
+def test_unknown_codec_falls_back_to_json():
+    assert get_codec("xml") is JSON
+    assert get_codec(None) is JSON
+
+
+def test_msgpack_uses_binary_frames():
+    pytest.importorskip("msgpack")
+    msgpack = get_codec("msgpack")
+    data = msgpack.dumps({"enemies": [{"pos": (3, 4)}]})
+    assert isinstance(data, bytes)
+    assert decode(data) == {"enemies": [{"pos": [3, 4]}]}
+
+
+def test_static_lists_are_encoded_once():
+    encoded = []
+
+    class Recording(codec.JsonCodec):
+        def _dumps(self, data):
+            encoded.append(data)
+            return super()._dumps(data)
+
+    rocks = Static([{"id": "r1", "pos": (1, 2)}])
+    recording = Recording()
+    for step in range(3):
+        data = recording.dumps({"step": step, "rocks": rocks})
+        assert decode(data) == {"step": step, "rocks": [{"id": "r1", "pos": [1, 2]}]}
+    assert [data for data in encoded if data is rocks] == [rocks]
+
+
+def test_packed_map_is_opt_in():
+    info = {"size": [2, 2], "map": [[1, 0], [0, 1]]}
+    assert decode(get_codec("json").dumps(info)) == info
+    packed = get_codec("json", packed_map=True)
+    assert packed.name == "json+packed"
+    data = decode(packed.dumps(info))
+    assert unpack_tiles(data["map"], data["size"]) == info["map"]
+    assert decode(packed.dumps({"step": 1})) == {"step": 1}
+
+
+def test_wire_size_counts_bytes():
+    assert codec.wire_size(JSON.dumps({"player": "Ze"})) == 16
+    assert codec.wire_size(json.dumps({"player": "Zé"}, ensure_ascii=False)) == 17
+    assert codec.wire_size(b"\x81\xa1a\x01") == 4
@@ -0,0 +1,44 @@
+import json
+import random
+
+from delta import DeltaDecoder
+from game import Game
+
+
+def roundtrip(message):
+    return json.loads(json.dumps(message))
+
+
+def test_decoder_rebuilds_every_frame():
+    random.seed(3)
+    keys = random.Random(3)
+    g = Game(level=8, delta=True)
+    g.start("John Doe")
+    decoder = DeltaDecoder()
+
+    sizes = []
+    while g.running and g._step < 500:
+        message = g.step(keys.choice("wasdAAB"))
+        if message is None:
+            continue
+        sizes.append(len(json.dumps(message)))
+        assert decoder.apply(roundtrip(message)) == roundtrip(g.state)
+
+    assert sum(sizes) < len(sizes) * len(json.dumps(g.state)) / 2
+
+
+def test_decoder_waits_for_keyframe():
+    random.seed(1)
+    g = Game(delta=True)
+    g.start("John Doe")
+    decoder = DeltaDecoder()
+
+    assert "keyframe" in g.step("d")
+    message = g.step("d")
+    assert "keyframe" not in message
+    assert decoder.apply(roundtrip(message)) is None  # joined mid-game
+
+    while "keyframe" not in (message := g.step("")):
+        assert decoder.apply(roundtrip(message)) is None
+    assert decoder.apply(roundtrip(message)) == roundtrip(g.state)
+    assert decoder.apply({"size": [48, 24]}) == {"size": [48, 24]}
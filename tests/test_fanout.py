@@ -0,0 +1,46 @@
+import asyncio
+
+from fanout import ViewerFeed
+
+
+class SlowSocket:
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.sent = []
+
+    async def send(self, message):
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError("gone")
+        self.sent.append(message)
+
+
+def test_slow_viewer_gets_latest_frames():
+    async def run():
+        ws = SlowSocket(delay=0.01)
+        feed = ViewerFeed(ws, maxsize=2)
+        feed.put("map", droppable=False)
+        for frame in range(10):
+            feed.put(str(frame))
+        assert len(feed) == 3  # never more than maxsize frames waiting
+        await asyncio.sleep(0.1)
+        feed.close()
+        return ws, feed
+
+    ws, feed = asyncio.run(run())
+    assert ws.sent == ["map", "8", "9"]
+    assert (feed.sent, feed.bytes, feed.dropped) == (3, 5, 8)
+
+
+def test_failed_viewer_is_closed():
+    closed = []
+
+    async def run():
+        feed = ViewerFeed(SlowSocket(fail=True), on_close=closed.append)
+        feed.put("frame")
+        await asyncio.sleep(0.01)
+        return feed
+
+    feed = asyncio.run(run())
+    assert closed == [feed]
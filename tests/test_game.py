@@ -0,0 +1,132 @@
+import json
+import random
+
+import pytest
+
+from consts import Direction
+from game import Game
+from mapa import Map
+
+KEYS = ["w", "a", "s", "d", "A", "A", "B", ""]
+
+
+class ReferenceGame(Game):
+    """Game with the original nested-loop collision phase."""
+
+    def collision(self):
+        if not self._running:
+            return
+        for e in self._enemies:
+            if e.pos == self._digdug.pos:
+                self.kill_digdug()
+                e.respawn()
+            if e._name == "Fygar" and e.fire:
+                if self._digdug.pos in e.fire:
+                    self.kill_digdug()
+        for r in self._rocks:
+            if r.pos == self._digdug.pos:
+                self.kill_digdug()
+            for e in self._enemies:
+                if r.pos == e.pos:
+                    e.kill(rock=True)
+                    self._score += e.points(self.map.ver_tiles)
+
+
+def strip_ids(state):
+    state = json.loads(json.dumps(state))  # step() reuses the state dict
+    for e in state["enemies"]:
+        del e["id"]
+    state["rocks"] = [r["pos"] for r in state["rocks"]]
+    return state
+
+
+def play(game_cls, seed, level, frames):
+    random.seed(seed)
+    keys = random.Random(seed)
+    g = game_cls(level=level)
+    g.start("seed")
+
+    trace = []
+    while g.running and len(trace) < frames:
+        state = g.step(keys.choice(KEYS))
+        trace.append(strip_ids(state) if state else None)
+    return trace, g.score
+
+
+@pytest.mark.parametrize("seed,level", [(1, 1), (2, 3), (3, 8), (4, 15), (5, 20)])
+def test_collision_matches_reference(seed, level):
+    expected = play(ReferenceGame, seed, level, 1500)
+    assert play(Game, seed, level, 1500) == expected
+
+
+def test_step_is_synchronous():
+    g = Game()
+    assert g.step("d") is None  # not started
+
+    g.start("John Doe")
+    state = g.step("d")
+    assert state["step"] == 1
+    assert state["digdug"] == (2, 1)
+    assert g.step()["step"] == 2
+
+
+def test_snapshot_restore():
+    random.seed(3)
+    g = Game(level=8)
+    g.start("John Doe")
+    for key in "ddddssssssAAAA":
+        g.step(key)
+
+    snapshot = g.snapshot()
+    tiles = [list(column) for column in g.map.map]
+
+    def future():
+        keys = random.Random(1)
+        return [json.dumps(g.step(keys.choice(KEYS))) for _ in range(300)], g.score
+
+    expected = future()
+    g.restore(snapshot)
+    assert [list(column) for column in g.map.map] == tiles
+    assert future() == expected
+    g.restore(snapshot)
+    assert future() == expected
+
+
+@pytest.mark.parametrize("seed,level", [(1, 1), (3, 8), (5, 20)])
+def test_zobrist_is_incremental(seed, level):
+    random.seed(seed)
+    keys = random.Random(seed)
+    g = Game(level=level)
+    g.start("John Doe")
+
+    seen = {g.zobrist}
+    while g.running and g._total_steps + g._step < 1000:
+        g.step(keys.choice(KEYS))
+        key = g.zobrist
+        g.rehash_all()
+        assert g.zobrist == key
+        assert g.map.zobrist == Map(mapa=g.map.map, size=g.map.size).zobrist
+        seen.add(key)
+    assert len(seen) > 100
+
+
+def test_state_records_are_reused():
+    random.seed(3)
+    g = Game(level=8)
+    g.start("John Doe")
+
+    state = g.step("d")
+    enemies, rocks = state["enemies"], state["rocks"]
+    assert g.step("d") is state
+    assert state["enemies"] is enemies and state["rocks"] is rocks
+    assert [e["pos"] for e in enemies] == [e.pos for e in g._enemies]
+
+
+def test_rope_direction_is_hashed():
+    g = Game()
+    g.start("John Doe")
+    keys = set()
+    for direction in (None, *Direction):
+        g._rope._dir = direction
+        keys.add(g.entity_key("rope"))
+    assert len(keys) == 5  # NORTH (0) is not "no direction"
@@ -0,0 +1,63 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import grading
+from grading import GradingQueue
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """Grading endpoint that is down for its first request."""
+
+    received = []
+    failures = 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if StandIn.failures:
+            StandIn.failures -= 1
+            self.send_response(503)
+        else:
+            StandIn.received.append(json.loads(body))
+            self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def test_records_survive_outages_and_restarts(tmp_path, monkeypatch):
+    monkeypatch.setattr(grading, "MIN_BACKOFF", 0.01)
+    httpd = HTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{httpd.server_port}/game"
+    spool = str(tmp_path / "grading.spool")
+
+    # server stopped before the grading host answered
+    queue = GradingQueue("http://127.0.0.1:1/game", spool)
+    queue.submit({"player": "a", "score": 10, "level": 1})
+    queue.close()
+
+    async def run():
+        queue = GradingQueue(url, spool, batch=2)
+        assert len(queue) == 1
+        worker = asyncio.create_task(queue.run())
+        queue.submit({"player": "b", "score": 20, "level": 2})
+        queue.submit({"player": "c", "score": 30, "level": 3})
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if not len(queue):
+                break
+        worker.cancel()
+        queue.close()
+        return queue
+
+    queue = asyncio.run(run())
+    httpd.shutdown()
+    assert [r["player"] for r in StandIn.received] == ["a", "b", "c"]
+    assert (queue.sent, queue.failures) == (3, 1)
+    restarted = GradingQueue(url, spool)
+    restarted.close()
+    assert len(restarted) == 0
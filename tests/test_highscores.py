@@ -0,0 +1,53 @@
+import asyncio
+import json
+import random
+
+from highscores import Highscores
+
+
+def reference(entries, size):
+    """How the server used to keep its list."""
+    scores = []
+    for entry in entries:
+        scores = sorted(scores + [entry], key=lambda s: s[1], reverse=True)[:size]
+    return scores
+
+
+def test_keeps_the_same_list_as_a_full_sort(tmp_path):
+    rng = random.Random(3)
+    entries = [(f"p{i}", rng.randrange(20)) for i in range(200)]
+    highscores = Highscores(str(tmp_path / "scores.json"), size=10)
+    for name, score in entries:
+        highscores._push(name, score)
+    assert highscores.top() == reference(entries, 10)
+
+
+def test_writes_are_coalesced_and_reloaded(tmp_path):
+    path = str(tmp_path / "scores.json")
+
+    async def run():
+        highscores = Highscores(path, size=3, delay=0.01)
+        for score in (5, 7, 1, 9):
+            highscores.add("p", score)
+        await asyncio.sleep(0.1)
+        return highscores
+
+    highscores = asyncio.run(run())
+    assert highscores.writes == 1
+    with open(path) as infile:
+        assert json.load(infile) == [["p", 9], ["p", 7], ["p", 5]]
+    assert Highscores(path, size=3).top() == highscores.top()
+
+
+def test_pending_flush_is_written_on_close(tmp_path):
+    path = str(tmp_path / "scores.json")
+
+    async def run():
+        highscores = Highscores(path, delay=60)
+        highscores.add("p", 3)
+        highscores.close()
+        return highscores
+
+    highscores = asyncio.run(run())
+    assert highscores.writes == 1
+    assert Highscores(path).top() == [("p", 3)]
@@ -0,0 +1,67 @@
+import pytest
+
+from codec import Message, decode, get_codec
+from game import Game
+from latency import InputLatency
+from server import Player
+from session import Session
+
+
+def test_keys_are_followed_to_the_step_using_them():
+    latency = InputLatency()
+    latency.sent(1)
+    latency.received("d", 1)
+    latency.applied(2)  # answered in time
+    latency.sent(2)
+    latency.sent(3)
+    latency.received("w", 2)  # frame 3 was already out
+    latency.received("a", 3)  # overwrites "w"
+    latency.applied(4)
+    latency.sent(4)
+    latency.received("s")  # client does not echo frames
+    latency.applied(5)
+    latency.received("A", 4)
+    latency.close()
+
+    report = latency.to_dict()
+    assert {k: report[k] for k in ("keys", "late", "overwritten", "dropped", "unlabelled")} == {
+        "keys": 5,
+        "late": 1,
+        "overwritten": 1,
+        "dropped": 1,
+        "unlabelled": 1,
+    }
+    assert report["frames_behind"] == {"1": 2}
+    assert report["timings"]["reply"]["count"] == 4
+    assert report["timings"]["applied"]["count"] == 2
+
+
+def test_key_used_by_a_level_change_is_applied():
+    session = Session(Player("p", None), 1)
+    session.start(Game)
+    session.step()
+    session.latency.sent(session.frames)
+    session.keypress("d", session.frames)
+    session.game._enemies = []  # level completed on the next step
+    assert session.step() is None
+    session.latency.sent(session.frames)
+    session.keypress("s", session.frames)
+    session.step()
+    session.latency.close()
+
+    report = session.latency.to_dict()
+    assert report["overwritten"] == 0 and report["dropped"] == 0
+    assert report["frames_behind"] == {"0": 1, "1": 1}
+
+
+def test_final_info_survives_msgpack():
+    pytest.importorskip("msgpack")
+    latency = InputLatency()
+    latency.sent(1)
+    latency.received("d", 1)
+    latency.applied(2)
+    game = Game()
+    game.start("p")
+    info = dict(game.info(), latency=latency.to_dict(), player="p")
+    codec = get_codec("msgpack")
+    assert decode(Message(info).encode(codec))["latency"]["frames_behind"] == {"1": 1}
@@ -1,3 +1,5 @@
+import base64
+
 import pytest
 from game import *
 from mapa import *
@@ -239,3 +241,46 @@ def test_map():
     # test blocked / diggable
     assert game.map.calc_pos((1, 1), Direction.SOUTH, traverse=False) == (1, 1)
     assert game.map.calc_pos((1, 1), Direction.SOUTH, traverse=True) == (1, 2)
+
+
+def test_reach():
+    mapa = Map(size=(13, 13), mapa=[list(col) for col in mapa13x13])
+
+    assert mapa.reach((3, 3), Direction.EAST, 3) == ((4, 3), (5, 3), (6, 3))
+    assert mapa.reach((10, 3), Direction.EAST, 3) == ((11, 3),)
+    assert mapa.reach((1, 3), Direction.WEST, 3) == ()
+
+    # digging invalidates the cached line
+    assert mapa.reach((1, 1), Direction.SOUTH, 3) == ()
+    mapa.dig((1, 2))
+    assert mapa.reach((1, 1), Direction.SOUTH, 3) == ((1, 2), (1, 3), (1, 4))
+
+
+def test_frozen_map():
+    mapa = Map(size=(13, 13), mapa=[list(col) for col in mapa13x13])
+    frozen = mapa.freeze()
+    assert frozen == mapa.freeze()
+
+    dug = frozen.dig((1, 2))
+    assert dug is not frozen
+    assert dug.get_tile((1, 2)) == Tiles.PASSAGE
+    assert frozen.get_tile((1, 2)) == Tiles.STONE
+    assert dug.map[0] is frozen.map[0]  # untouched columns are shared
+    assert dug.dig((1, 2)) is dug  # already a passage
+
+    # usable in closed sets
+    assert dug in {frozen.dig((1, 2))}
+    assert frozen.dig((1, 2)).dig((0, 5)) == frozen.dig((0, 5)).dig((1, 2))
+    assert dug.calc_pos((1, 1), Direction.SOUTH, traverse=False) == (1, 2)
+
+
+def test_packed_tiles():
+    mapa = Map(size=(13, 13), mapa=[list(col) for col in mapa13x13])
+    packed = pack_tiles(mapa.map)
+    assert len(packed) == 22  # 169 bits
+    assert unpack_tiles(packed, mapa.size) == mapa.map
+    assert unpack_tiles(base64.b64encode(packed).decode(), mapa.size) == mapa.map
+    assert unpack_tiles(mapa.map, mapa.size) is mapa.map  # not packed
+
+    mapa.dig((1, 2))
+    assert unpack_tiles(pack_tiles(mapa.map), mapa.size)[1][2] == Tiles.PASSAGE
@@ -0,0 +1,36 @@
+import asyncio
+
+from metrics import Registry
+
+
+def test_render_and_serve():
+    registry = Registry()
+    frames = registry.counter("frames_total", "Frames")
+    lag = registry.histogram("lag_seconds", "Lag", buckets=(0.01, 0.1))
+    registry.gauge("sessions", "Sessions", lambda: 2)
+    frames.inc(3)
+    for value in (0.0, 0.05, 0.05, 1.0):
+        lag.observe(value)
+
+    text = registry.render()
+    assert "# TYPE frames_total counter\nframes_total 3\n" in text
+    assert 'lag_seconds_bucket{le="0.01"} 1\n' in text
+    assert 'lag_seconds_bucket{le="0.1"} 3\n' in text
+    assert 'lag_seconds_bucket{le="+Inf"} 4\n' in text
+    assert "lag_seconds_sum 1.1\n" in text
+    assert "sessions 2\n" in text
+
+    async def scrape(path):
+        server = await registry.serve("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: x\r\n\r\n".encode())
+        response = await reader.read()
+        writer.close()
+        server.close()
+        return response.decode()
+
+    response = asyncio.run(scrape("/metrics"))
+    assert response.startswith("HTTP/1.1 200 OK")
+    assert response.endswith(text)
+    assert asyncio.run(scrape("/")).startswith("HTTP/1.1 404")
@@ -0,0 +1,34 @@
+import json
+import random
+
+from game import Game
+from profiler import FrameProfiler
+
+
+def test_disabled_records_nothing():
+    g = Game()
+    g.start("John Doe")
+    g.step("d")
+    assert g.profiler.to_dict() == {}
+
+
+def test_phases_and_exports():
+    random.seed(1)
+    g = Game()
+    g.profiler = FrameProfiler(enabled=True, window=50)
+    g.start("John Doe")
+    for _ in range(100):
+        g.step("d")
+
+    report = json.loads(g.profiler.to_json())
+    assert report["step;collision1"]["count"] == 50
+    assert {"step;update_digdug", "step;enemies", "step;state"} <= report.keys()
+    assert sum(report["step;rocks"]["histogram_us"].values()) == 50
+
+    for line in g.profiler.folded().splitlines():
+        stack, total = line.rsplit(" ", 1)
+        assert stack.startswith("tick;step;") and int(total) >= 0
+
+    g.profiler.toggle()
+    g.step("d")
+    assert json.loads(g.profiler.to_json()) == report
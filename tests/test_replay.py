@@ -0,0 +1,61 @@
+import json
+import random
+
+from game import Game
+from replay import KeyframeRecorder, KeyframeReplay, Replay, ReplayRecorder, open_replay
+
+
+def record(seed, keys):
+    random.seed(seed)
+    g = Game(level=3, timeout=400)
+    g.recorder = ReplayRecorder(seed, 3, g._initial_lives, 400, "John Doe")
+    g.start("John Doe")
+    states = []
+    while g.running:
+        states.append(json.dumps(g.step(keys.choice("wasdAB x"))))
+    return g, states
+
+
+def positions(state):
+    state = json.loads(state)
+    return state["digdug"], [e["pos"] for e in state["enemies"]], state["score"]
+
+
+def test_replay_rebuilds_every_frame():
+    g, states = record(42, random.Random(1))
+    data = g.recorder.to_bytes()
+    assert len(data) < 32 + len(states)
+
+    replay = Replay.from_bytes(data)
+    assert (replay.seed, replay.level, replay.player) == (42, 3, "John Doe")
+    assert len(replay) == len(states)
+
+    assert replay.play().score == g.score
+
+    game = replay.seek(100)
+    assert positions(json.dumps(game.state)) == positions(states[99])
+    replay.seek(250, game)
+    assert positions(json.dumps(game.state)) == positions(states[249])
+
+
+def test_keyframe_replay_seeks(tmp_path):
+    random.seed(42)
+    keys = random.Random(1)
+    g = Game(level=3, timeout=400)
+    g.recorder = KeyframeRecorder(g, 42, 3, g._initial_lives, 400, "John Doe", interval=50)
+    g.start("John Doe")
+    states = []
+    while g.running:
+        states.append(json.dumps(g.step(keys.choice("wasdAB x"))))
+    path = tmp_path / "game.ddrx"
+    g.recorder.save(path)
+
+    replay = open_replay(path)
+    assert isinstance(replay, KeyframeReplay)
+    assert len(replay) == len(states)
+    assert replay._frames == list(range(0, len(states), 50))
+
+    for frame in [1, 50, 51, 199, 233, len(states)]:
+        game = replay.seek(frame)
+        assert positions(json.dumps(game.state)) == positions(states[frame - 1])
+    assert replay.play().score == g.score
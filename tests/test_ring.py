@@ -0,0 +1,55 @@
+from ring import Ring
+
+
+def test_messages_in_order_and_latest_wins():
+    writer = Ring.create(4, 8)
+    reader = Ring.attach(writer.name)
+    try:
+        assert reader.get() is None
+        writer.put(1, b"a")
+        writer.put(2, b"bc")
+        assert reader.get() == (1, b"a")
+        assert reader.get() == (2, b"bc")
+        assert reader.get() is None
+
+        for i in range(10):  # reader falls behind
+            writer.put(0, bytes([i]))
+        assert [reader.get()[1][0] for _ in range(4)] == [6, 7, 8, 9]
+        assert reader.lost == 6
+        assert reader.get() is None
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_oversized_message_is_refused():
+    ring = Ring.create(2, 4)
+    try:
+        ring.put(0, b"12345678")  # as large as the whole ring
+        try:
+            ring.put(0, b"123456789")
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("expected ValueError")
+    finally:
+        ring.close()
+
+
+def test_large_messages_span_slots():
+    writer = Ring.create(4, 4)
+    reader = Ring.attach(writer.name)
+    try:
+        writer.put(1, b"0123456789")
+        writer.put(2, b"ab")
+        assert reader.get() == (1, b"0123456789")
+        assert reader.get() == (2, b"ab")
+
+        writer.put(1, b"0123456789")  # 3 slots, then its start is overwritten
+        writer.put(2, b"abcdef")
+        assert reader.get() == (2, b"abcdef")
+        assert reader.lost == 3
+        assert reader.get() is None
+    finally:
+        reader.close()
+        writer.close()
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import random
+
+import pytest
+
+from delta import DeltaDecoder
+from game import Game
+from server import GameServer, Player
+from session import Session
+
+
+class FakeSocket:
+    closed = False
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+    async def close(self):
+        self.closed = True
+
+
+def positions(state):
+    state = json.loads(json.dumps(state))
+    return state["digdug"], [e["pos"] for e in state["enemies"]], state["score"]
+
+
+def test_sessions_keep_their_own_random_state():
+    random.seed(5)
+    solo = Game(timeout=100)
+    solo.start("a")
+    expected = [positions(solo.step("d")) for _ in range(99)]
+
+    sessions = [Session(Player(name, None), seed) for name, seed in (("a", 5), ("b", 6))]
+    for session in sessions:
+        session.start(lambda: Game(timeout=100))
+    for frame in expected:
+        state = sessions[0].step("d")
+        sessions[1].step("s")
+        random.random()  # the server's own draws do not leak into games
+        assert positions(state) == frame
+
+
+def test_players_are_served_concurrently(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def serve():
+        server = GameServer(0, -1, seed=3, replays=None, max_sessions=2)
+        sockets = [FakeSocket() for _ in range(3)]
+        for i, ws in enumerate(sockets):
+            await server.players.put(Player(f"p{i}", ws))
+        viewer = FakeSocket()
+        server.add_viewer(viewer)
+        server.viewers.add(viewer)
+        loop = asyncio.create_task(server.mainloop())
+        await asyncio.sleep(0.5)
+        assert len(server.sessions) == 2
+        assert server.featured.player.name == "p0"
+        metrics = server.metrics.render()
+        assert "digdug_sessions_active 2\n" in metrics
+        assert "digdug_players_waiting 1\n" in metrics
+        loop.cancel()
+        return sockets + [viewer]
+
+    first, second, queued, viewer = asyncio.run(serve())
+    assert viewer.sent[0] == first.sent[0]
+    assert {state["player"] for state in viewer.sent[1:]} == {"p0"}
+    assert first.sent[0]["map"] == second.sent[0]["map"]  # same --seed
+    assert len(first.sent) > 5 and len(second.sent) > 5
+    assert [state["frame"] for state in first.sent[1:4]] == [1, 2, 3]
+    assert queued.sent == []
+
+
+def test_second_join_on_a_socket_is_ignored():
+    class JoiningSocket(FakeSocket):
+        async def __aiter__(self):
+            for name in ("a", "b"):
+                yield json.dumps({"cmd": "join", "name": name})
+
+    async def join():
+        server = GameServer(0, -1, replays=None)
+        await server.incomming_handler(JoiningSocket(), "/player")
+        return server.players
+
+    players = asyncio.run(join())
+    assert players.qsize() == 1
+    assert players.get_nowait().name == "a"
+
+
+@pytest.mark.parametrize("processes", [False, True])
+def test_viewers_get_full_states_in_delta_mode(tmp_path, monkeypatch, processes):
+    monkeypatch.chdir(tmp_path)
+
+    async def serve():
+        server = GameServer(0, -1, seed=3, replays=None, delta=True, processes=processes)
+        player = FakeSocket()
+        await server.players.put(Player("p", player))
+        viewer = FakeSocket()
+        server.add_viewer(viewer)
+        server.viewers.add(viewer)
+        loop = asyncio.create_task(server.mainloop())
+        for _ in range(100):
+            await asyncio.sleep(0.05)
+            if len(viewer.sent) > 5:
+                break
+        session = server.sessions[player]
+        loop.cancel()
+        await session.close()
+        return player, viewer
+
+    player, viewer = asyncio.run(serve())
+    decoder = DeltaDecoder()
+    decoded = [decoder.apply(dict(message)) for message in player.sent]
+    assert "seq" in player.sent[2] and "seq" not in viewer.sent[2]
+    assert [state["frame"] for state in viewer.sent[1:4]] == [1, 2, 3]
+    assert positions(viewer.sent[3]) == positions(decoded[3])
+
+
+def test_profiles_are_saved_per_session(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    server = GameServer(0, -1, replays=None, profile=True)
+    sessions = [Session(Player(name, None), 1) for name in ("a b", "c")]
+    for session in sessions:
+        session.start(lambda: server.new_game(session))
+        session.step()
+        asyncio.run(server.save_profile(session))
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(
+        f"profile-{s.id}-{name}.{ext}"
+        for s, name in zip(sessions, ("a_b", "c"))
+        for ext in ("json", "folded")
+    )
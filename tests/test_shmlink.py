@@ -0,0 +1,65 @@
+import asyncio
+
+from codec import JSON
+from server import GameServer, Player
+from shmlink import DELTA, END, FRAME, INFO, LocalLink, pack_key, unpack_key
+from test_session import FakeSocket
+
+
+def test_keys_round_trip():
+    assert unpack_key(pack_key("d", 7)) == ("d", 7)
+    assert unpack_key(pack_key("", None)) == ("", None)
+
+
+def test_latest_frame_wins_but_info_and_end_are_kept():
+    server = LocalLink.create()
+    agent = LocalLink.attach(**server.names, track=True)
+    try:
+        assert agent.recv() is None
+        server.send(INFO, JSON.dumps({"level": 1}))
+        for frame in range(1, 4):
+            server.send(FRAME, JSON.dumps({"frame": frame}))
+        assert agent.recv() == {"level": 1}
+        assert agent.recv() == {"frame": 3}
+        server.send(FRAME, JSON.dumps({"frame": 4}))
+        server.send(END, JSON.dumps({"score": 10}))
+        assert agent.recv() == {"score": 10}
+        assert agent.closed
+
+        for seq in (1, 2):
+            server.send(DELTA, JSON.dumps({"seq": seq}))
+        assert [agent.recv(), agent.recv(), agent.recv()] == [{"seq": 1}, {"seq": 2}, None]
+
+        agent.send_key("a", 3)
+        agent.send_key("s")
+        assert list(server.keys()) == [("a", 3), ("s", None)]
+        assert list(server.keys()) == []
+    finally:
+        agent.close()
+        server.close()
+
+
+def test_player_over_shared_memory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def serve():
+        server = GameServer(0, -1, seed=3, replays=None)
+        ws = FakeSocket()
+        link = LocalLink.create()
+        agent = LocalLink.attach(**link.names, track=True)
+        await server.players.put(Player("p", ws, JSON, link))
+        loop = asyncio.create_task(server.mainloop())
+        info = await agent.wait(1)
+        state = await agent.wait(1)
+        agent.send_key("d", state["frame"])
+        await asyncio.sleep(0.2)
+        session = server.sessions[ws]
+        loop.cancel()
+        agent.close()
+        return ws, info, state, session
+
+    ws, info, state, session = asyncio.run(serve())
+    assert ws.sent == []  # everything went through shared memory
+    assert "map" in info
+    assert state["player"] == "p"
+    assert session.latency.keys == 1
@@ -0,0 +1,68 @@
+import asyncio
+import json
+import random
+
+from game import Game
+from server import GameServer, Player
+from test_session import FakeSocket, positions
+
+
+def test_game_runs_in_a_simulation_process(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    random.seed(3)
+    local = Game()
+    local.start("p")
+    expected = [positions(local.step()) for _ in range(20)]
+
+    async def serve():
+        server = GameServer(0, -1, seed=3, replays=None, processes=True)
+        ws = FakeSocket()
+        await server.players.put(Player("p", ws))
+        loop = asyncio.create_task(server.mainloop())
+        for _ in range(100):
+            await asyncio.sleep(0.05)
+            if len(ws.sent) > 21:
+                break
+        session = server.sessions[ws]
+        session.keypress("d", ws.sent[-1]["frame"])
+        await asyncio.sleep(0.1)
+        assert session.latency.to_dict()["frames_behind"]
+        loop.cancel()
+        await session.close()
+        return ws
+
+    ws = asyncio.run(serve())
+    assert [positions(state) for state in ws.sent[1:21]] == expected
+
+
+def test_viewer_joins_while_a_simulation_launches(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    class ViewerSocket(FakeSocket):
+        async def __aiter__(self):
+            yield json.dumps({"cmd": "join"})
+            await asyncio.Event().wait()  # stays connected
+
+    async def serve():
+        server = GameServer(0, -1, seed=3, replays=None, processes=True)
+        ws = FakeSocket()
+        await server.players.put(Player("p", ws))
+        loop = asyncio.create_task(server.mainloop())
+        await asyncio.sleep(0.01)  # the simulation process is starting
+        viewer = ViewerSocket()
+        handler = asyncio.create_task(server.incomming_handler(viewer, "/viewer"))
+        server.toggle_profiler()
+        for _ in range(100):
+            await asyncio.sleep(0.05)
+            if len(viewer.sent) > 3:
+                break
+        session = server.sessions[ws]
+        assert not handler.done()
+        handler.cancel()
+        loop.cancel()
+        await session.close()
+        return viewer
+
+    viewer = asyncio.run(serve())
+    assert "map" in viewer.sent[0]
+    assert [state["frame"] for state in viewer.sent[1:4]] == [1, 2, 3]
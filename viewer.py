@@ -8,7 +8,9 @@ import sys
 import pygame
 import websockets
 
-from mapa import Map, Tiles
+from codec import decode
+from delta import DeltaDecoder
+from mapa import Map, Tiles, unpack_tiles
 
 logging.basicConfig(level=logging.DEBUG)
 logger_websockets = logging.getLogger("websockets")
@@ -105,9 +107,12 @@ RANKS = {
 SPRITES = None
 
 
-async def messages_handler(ws_path, queue):
+async def messages_handler(ws_path, queue, player=None):
     async with websockets.connect(ws_path) as websocket:
-        await websocket.send(json.dumps({"cmd": "join"}))
+        join = {"cmd": "join", "map": "packed"}
+        if player:
+            join["player"] = player
+        await websocket.send(json.dumps(join))
 
         while True:
             r = await websocket.recv()
@@ -360,10 +365,13 @@ async def main_game():
     logging.info("Waiting for map information from server")
     state = await q.get()  # first state message includes map information
     logging.debug("Initial game status: %s", state)
-    newgame_json = json.loads(state)
+    newgame_json = decode(state)
 
     GAME_SPEED = newgame_json["fps"]
-    mapa = Map(size=newgame_json["size"], mapa=newgame_json["map"])
+    mapa = Map(
+        size=newgame_json["size"],
+        mapa=unpack_tiles(newgame_json["map"], newgame_json["size"]),
+    )
     SCREEN = pygame.display.set_mode(scale(mapa.size))
     SPRITES = pygame.image.load("data/digdug.png").convert_alpha()
 
@@ -372,12 +380,13 @@ async def main_game():
     main_group.add(DigDug(pos=mapa.digdug_spawn))
 
     state = {"score": 0, "player": "player1", "digdug": (1, 1)}
+    decoder = DeltaDecoder()
 
     while True:
         if "size" in state and "map" in state:
             # New level! lets clean everything up!
             logger.info("New level! %s", state["level"])
-            mapa = Map(size=state["size"], mapa=state["map"])
+            mapa = Map(size=state["size"], mapa=unpack_tiles(state["map"], state["size"]))
             BACKGROUND = draw_background(mapa)
 
             SCREEN.blit(BACKGROUND, (0, 0))
@@ -547,10 +556,12 @@ async def main_game():
         pygame.display.flip()
 
         try:
-            state = json.loads(q.get_nowait())
+            message = decoder.apply(decode(q.get_nowait()))
         except asyncio.queues.QueueEmpty:
             await asyncio.sleep(1.0 / GAME_SPEED)
             continue
+        if message is not None:  # else we joined mid-game, wait for a keyframe
+            state = message
 
 
 if __name__ == "__main__":
@@ -563,6 +574,9 @@ if __name__ == "__main__":
         "--scale", help="reduce size of window by x times", type=int, default=1
     )
     parser.add_argument("--port", help="TCP port", type=int, default=PORT)
+    parser.add_argument(
+        "--player", help="watch this player's game instead of the oldest one"
+    )
     args = parser.parse_args()
     SCALE = args.scale
 
@@ -574,7 +588,7 @@ if __name__ == "__main__":
 
     try:
         LOOP.run_until_complete(
-            asyncio.gather(messages_handler(ws_path, q), main_loop(q))
+            asyncio.gather(messages_handler(ws_path, q, args.player), main_loop(q))
         )
     finally:
         LOOP.stop()